@@ -0,0 +1,52 @@
+"""add_track_and_playlist_indexes
+
+Revision ID: c3f1d8a4e2b7
+Revises: 89fb8a25c018
+Create Date: 2026-10-15 23:05:41.512903
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3f1d8a4e2b7'
+down_revision: Union[str, Sequence[str], None] = '89fb8a25c018'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table("tracks", schema=None) as batch_op:
+        batch_op.alter_column('uuid',
+               existing_type=sa.String(),
+               type_=sa.String(length=36),
+               existing_nullable=False)
+        batch_op.create_index(
+            'ix_tracks_uploader_status', ['uploader', 'status'], unique=False
+        )
+        batch_op.create_index(
+            'ix_tracks_status_created', ['status', 'created_at'], unique=False
+        )
+
+    with op.batch_alter_table("playlist_tracks", schema=None) as batch_op:
+        batch_op.create_index(
+            'ix_pt_playlist_position', ['playlist_id', 'position'], unique=False
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("playlist_tracks", schema=None) as batch_op:
+        batch_op.drop_index('ix_pt_playlist_position')
+
+    with op.batch_alter_table("tracks", schema=None) as batch_op:
+        batch_op.drop_index('ix_tracks_status_created')
+        batch_op.drop_index('ix_tracks_uploader_status')
+        batch_op.alter_column('uuid',
+               existing_type=sa.String(length=36),
+               type_=sa.String(),
+               existing_nullable=False)
@@ -3,6 +3,8 @@ import os
 import time
 import uuid
 import asyncio
+from typing import Mapping, Optional
+from fastapi import Request, HTTPException, status
 from pydantic import BaseModel
 
 class User(BaseModel):
@@ -160,38 +162,29 @@ if __name__ == '__main__':
 # Instantiate SessionManager globally within auth.py
 session_manager = SessionManager()
 
-# Imports for get_current_user
-from fastapi import Request, HTTPException, status
-
-async def get_current_user(request: Request) -> User:
-    print(f"get_current_user: All request cookies: {request.cookies}") # Debug print
-    sid = request.cookies.get("sid")
-    print(f"get_current_user: SID from cookie: {sid}") # Debug print
+def _resolve_user_from_cookies(cookies: Mapping[str, str]) -> Optional[User]:
+    """Returns the user behind the "sid" cookie, or None if there is no valid session.
+    Shared by the HTTP dependency and the WebSocket handshake."""
+    sid = cookies.get("sid")
     if not sid:
-        print("get_current_user: SID not found in cookies.") # Debug print
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Not authenticated",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        return None
 
     # Use the global session_manager from this module
-    print(f"get_current_user: Validating SID '{sid}' with session_manager.") # Debug print
     username = session_manager.get_session(sid)
-    print(f"get_current_user: Username from session_manager: {username}") # Debug print
     if not username:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid session token",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        return None
 
-    users = load_users()
-    current_user_data = next((user for user in users if user["username"] == username), None)
+    current_user_data = next((user for user in load_users() if user["username"] == username), None)
     if not current_user_data:
+        return None
+    return User(username=current_user_data["username"], is_admin=current_user_data["is_admin"])
+
+async def get_current_user(request: Request) -> User:
+    current_user = _resolve_user_from_cookies(request.cookies)
+    if current_user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found for session", # Should ideally not happen
+            detail="Not authenticated" if not request.cookies.get("sid") else "Invalid session token",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return User(username=current_user_data["username"], is_admin=current_user_data["is_admin"])
+    return current_user
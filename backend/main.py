@@ -14,6 +14,7 @@ from backend.routes import admin as admin_router # Added admin router
 from backend.routes import removal_requests as removal_requests_router # Added removal_requests router
 from backend.ws import router as ws_router
 from backend.ws import presence_updater_task # Added presence updater task
+from backend.ws import chat_writer_task
 from backend.torb.models import UserPreference
 from backend.routes.preferences import get_db
 from sqlalchemy.orm import Session
@@ -38,15 +39,18 @@ from backend.routes.upload import create_media_directories # Import the function
 
 # Define a variable to hold the presence updater task
 presence_task = None
+chat_writer = None
 
 # Configure Loguru
 logger.remove() # Remove default handler
-logger.add(sys.stderr, level="INFO") # Log to stderr with INFO level
+# enqueue=True: sinks are written by loguru's background thread, so a slow stderr pipe or
+# disk never blocks the event loop (WebSocket handlers log on every connect/disconnect)
+logger.add(sys.stderr, level="INFO", enqueue=True) # Log to stderr with INFO level
 logger.add("logs/backend_{time}.log", rotation="1 day", level="INFO", enqueue=True) # Log to file with daily rotation
 
 @app.on_event("startup")
 async def startup_event():
-    global presence_task
+    global presence_task, chat_writer
     logger.info("Torb Records API starting up...")
     # Start the session cleanup task using the imported session_manager
     await session_manager.start_cleanup_task()
@@ -56,10 +60,13 @@ async def startup_event():
     loop = asyncio.get_event_loop()
     presence_task = loop.create_task(presence_updater_task())
     logger.info("Presence updater task started.")
+    # Start the batched chat message writer
+    chat_writer = loop.create_task(chat_writer_task())
+    logger.info("Chat writer task started.")
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    global presence_task
+    global presence_task, chat_writer
     logger.info("Torb Records API shutting down...")
     if presence_task:
         presence_task.cancel()
@@ -67,6 +74,12 @@ async def shutdown_event():
             await presence_task
         except asyncio.CancelledError:
             logger.info("Presence updater task cancelled.")
+    if chat_writer:
+        chat_writer.cancel()
+        try:
+            await chat_writer
+        except asyncio.CancelledError:
+            logger.info("Chat writer task cancelled.")
     await session_manager.close() # Gracefully stop cleanup task of the imported session_manager
     logger.info("Torb Records API shutdown complete.")
 
@@ -3,18 +3,16 @@ from sqlalchemy.orm import Session
 from backend.torb.models import Chat
 from backend.auth import get_current_user, User # For protecting the endpoint
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_serializer
 import datetime
 
 # Placeholder for database session dependency
 # This should align with how sessions are managed in the rest of your FastAPI app
 # e.g., using a dependency injector like in backend/routes/preferences.py
-from sqlalchemy import create_engine, or_
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import or_
 
-DATABASE_URL = "sqlite:///./torb.db" # Ensure this matches your main DB URL
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Session factory on the app's shared (WAL, pooled) engine
+from backend.routes.preferences import SessionLocal
 
 def get_db():
     db = SessionLocal()
@@ -32,15 +30,23 @@ router = APIRouter(
 
 from typing import Optional # Add Optional
 
+def format_chat_timestamp(created_at: datetime.datetime) -> str:
+    """Chat timestamps on the wire (WebSocket and history): fixed-format UTC ending in Z.
+    Rows read back from SQLite are naive but were stored as UTC, so both forms format alike."""
+    return created_at.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
 class ChatMessageResponse(BaseModel):
+    model_config = {"from_attributes": True}
+
     id: int
     sender: str
     content: str
-    timestamp: datetime.datetime # Will be automatically converted to ISO string by FastAPI
+    timestamp: datetime.datetime = Field(validation_alias="created_at") # Chat.created_at
     target: Optional[str] = None # Add target for DMs
 
-    class Config:
-        orm_mode = True
+    @field_serializer("timestamp")
+    def _serialize_timestamp(self, timestamp: datetime.datetime) -> str:
+        return format_chat_timestamp(timestamp)
 
 @router.get("", response_model=List[ChatMessageResponse])
 async def get_chat_messages(
@@ -8,11 +8,24 @@ from pydantic import BaseModel, Json # For request body validation
 # Database session dependency (assuming a get_db function exists or will be created)
 # For now, let's assume a placeholder for DB session management.
 # This will need to be integrated with the actual DB session setup in main.py or a shared module.
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
 DATABASE_URL = "sqlite:///./torb.db" # Replace with your actual database URL
-engine = create_engine(DATABASE_URL)
+# Shared by every module that talks to torb.db (ws.py and routes/chat.py import it from here).
+# Sessions are also opened from worker threads (asyncio.to_thread, background tasks), so
+# pooled connections must not be pinned to the thread that created them.
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False}, pool_size=5)
+
+# WAL lets readers run alongside the writer, and synchronous=NORMAL only fsyncs at
+# checkpoints instead of on every commit (still crash-safe in WAL mode).
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def get_db():
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
+from pathlib import Path
 from typing import List
 
 from backend.auth import User, get_current_user # User and get_current_user from auth
@@ -10,6 +11,9 @@ from pydantic import BaseModel
 
 router = APIRouter()
 
+# Directory that the 'media-data/' prefix of a track's hls_root refers to (relative to the CWD)
+MEDIA_ROOT = Path("media-data")
+
 class TrackResponse(BaseModel):
     id: int
     title: str
@@ -69,7 +73,7 @@ async def stream_track_hls(
 
 
     return FileResponse(
-        path=master_m3u8_path,
+        path=MEDIA_ROOT / master_m3u8_path.removeprefix("media-data/"),
         media_type="application/vnd.apple.mpegurl",
         headers={
             "Content-Disposition": f"inline; filename=\"master.m3u8\""
@@ -1,51 +1,105 @@
+import contextvars
+import itertools
 import pytest
-from sqlalchemy import create_engine
+from functools import lru_cache
+from types import SimpleNamespace
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Connection
 from sqlalchemy.orm import sessionmaker, Session as SQLAlchemySession
+from sqlalchemy.pool import StaticPool
 from fastapi.testclient import TestClient
-import os # For environment variables if needed, though direct patching is used here
+from typing import Optional
 
 from backend.main import app
+from backend.routes.preferences import get_db
 from backend.torb.models import Base
 
+# Shared test helpers get pytest's assertion rewriting; must run before they are imported
+pytest.register_assert_rewrite("backend.tests.utils")
+
+from backend.tests.utils import create_test_session_for_app  # noqa: E402
+
+# uvloop (installed with uvicorn[standard]) runs the pytest-asyncio event loop when available
+try:
+    import uvloop
+except ImportError:  # e.g. Windows
+    uvloop = None
+
+if uvloop is not None:
+    def pytest_asyncio_loop_factories(config, item):
+        return {"uvloop": uvloop.new_event_loop}
+
 # --- Database Setup ---
-SQLALCHEMY_TEST_DATABASE_URL = "sqlite:///:memory:"
+# One shared in-memory database for the whole test session. StaticPool hands every
+# session the same DBAPI connection, so all of them see the same tables and rows.
+SQLALCHEMY_TEST_DATABASE_URL = "sqlite://"
 
 engine = create_engine(
     SQLALCHEMY_TEST_DATABASE_URL,
-    connect_args={"check_same_thread": False}  # Needed for SQLite in-memory
+    connect_args={"check_same_thread": False},  # Needed for SQLite in-memory
+    poolclass=StaticPool,
 )
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, join_transaction_mode="create_savepoint")
+
+# pysqlite defers BEGIN until the first DML statement, which makes a SAVEPOINT the
+# outermost transaction and lets its RELEASE commit. Emit BEGIN ourselves instead.
+@event.listens_for(engine, "connect")
+def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+@event.listens_for(engine, "begin")
+def _emit_begin(conn):
+    conn.exec_driver_sql("BEGIN")
+
+# Throwaway test database: skip durability work on every commit
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=MEMORY")
+    cursor.execute("PRAGMA synchronous=OFF")
+    cursor.execute("PRAGMA locking_mode=EXCLUSIVE")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+# Connection (with an open outer transaction) that the current test and the API share
+_test_connection: contextvars.ContextVar[Optional[Connection]] = contextvars.ContextVar("_test_connection", default=None)
 
-def apply_db_url_overrides(monkeypatch: pytest.MonkeyPatch):
-    """Applies DATABASE_URL overrides to relevant modules."""
-    monkeypatch.setattr("backend.routes.chat.DATABASE_URL", SQLALCHEMY_TEST_DATABASE_URL)
-    monkeypatch.setattr("backend.ws.DATABASE_URL", SQLALCHEMY_TEST_DATABASE_URL)
+def override_get_db():
+    """get_db override: binds to the current test's connection when there is one."""
+    try:
+        db_session = TestingSessionLocal(bind=_test_connection.get() or engine)
+        yield db_session
+    finally:
+        db_session.close()
 
-    # After patching DATABASE_URL, SessionLocal in those modules must be re-initialized
-    # This assumes SessionLocal is defined at the module level in chat.py and ws.py
+def apply_session_overrides(monkeypatch: pytest.MonkeyPatch):
+    """Points the modules that open their own sessions at the shared test engine."""
     from backend.routes import chat as chat_route
+    from backend.routes import preferences as preferences_route
     from backend import ws as ws_module
 
-    chat_route.engine = create_engine(SQLALCHEMY_TEST_DATABASE_URL, connect_args={"check_same_thread": False})
-    chat_route.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=chat_route.engine)
-
-    ws_module.engine = create_engine(SQLALCHEMY_TEST_DATABASE_URL, connect_args={"check_same_thread": False})
-    ws_module.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=ws_module.engine)
+    monkeypatch.setattr(chat_route, "SessionLocal", TestingSessionLocal)
+    monkeypatch.setattr(ws_module, "SessionLocal", TestingSessionLocal)
+    # Background upload processing opens sessions from preferences.SessionLocal directly;
+    # left alone it would write to (and switch to WAL) the real torb.db
+    monkeypatch.setattr(preferences_route, "SessionLocal", TestingSessionLocal)
 
 @pytest.fixture(scope="session", autouse=True)
 def test_db_session_override(monkeypatch_session_scope: pytest.MonkeyPatch):
     """
     Session-scoped fixture to:
-    1. Override DATABASE_URL in necessary modules.
+    1. Point module-level session factories and the app's get_db dependency at the test engine.
     2. Create all database tables.
     3. Yield for the test session.
     4. Drop all database tables after the session.
     """
-    apply_db_url_overrides(monkeypatch_session_scope)
+    apply_session_overrides(monkeypatch_session_scope)
+    app.dependency_overrides[get_db] = override_get_db
 
     Base.metadata.create_all(bind=engine) # Create tables using the test engine
     yield
     Base.metadata.drop_all(bind=engine) # Drop tables
+    app.dependency_overrides.pop(get_db, None)
 
 @pytest.fixture(scope="session")
 def monkeypatch_session_scope():
@@ -53,36 +107,54 @@ def monkeypatch_session_scope():
     with pytest.MonkeyPatch.context() as mp:
         yield mp
 
+@pytest.fixture(scope="session", autouse=True)
+def _fast_session_tokens(monkeypatch_session_scope: pytest.MonkeyPatch):
+    """
+    Swaps the uuid module seen by backend.auth for a counter, so session tokens are cheap
+    and deterministic ("tst-00000000", ...). Other uuid users (e.g. Track.uuid) are untouched.
+    """
+    counter = itertools.count()
+    monkeypatch_session_scope.setattr("backend.auth.uuid", SimpleNamespace(uuid4=lambda: f"tst-{next(counter):08d}"))
+
 @pytest.fixture(scope="function")
-def db() -> SQLAlchemySession:
+def db_connection() -> Connection:
     """
-    Provides a transactional database session for each test function.
-    Rolls back the transaction after the test to ensure isolation.
+    Opens an outer transaction on the shared connection for one test.
+    Every commit made by the test or the API releases a SAVEPOINT on it, and rolling
+    the outer transaction back restores a clean database without any DDL.
     """
     connection = engine.connect()
     transaction = connection.begin()
-    session = TestingSessionLocal(bind=connection)
-    yield session
-    session.close()
+    token = _test_connection.set(connection)
+    yield connection
+    _test_connection.reset(token)
     transaction.rollback()
     connection.close()
 
+@pytest.fixture(scope="function")
+def db(db_connection: Connection) -> SQLAlchemySession:
+    """
+    Provides a transactional database session for each test function.
+    Rolls back the transaction after the test to ensure isolation.
+    Seeded objects are not expired on commit, so reading back their ids costs no SELECT;
+    the API's own sessions keep the default expiry so responses match production.
+    """
+    session = TestingSessionLocal(bind=db_connection, expire_on_commit=False)
+    yield session
+    session.close()
+
 @pytest.fixture(scope="module")
 def client() -> TestClient:
     """
     Provides a TestClient for the FastAPI application.
     The app will use the overridden (test) database due to `test_db_session_override`.
     """
-    # If your app uses Depends(get_db) for session management in routes,
-    # you might need to override that dependency here for the TestClient.
-    # Example:
-    # def override_get_db():
-    #     try:
-    #         db_session = TestingSessionLocal()
-    #         yield db_session
-    #     finally:
-    #         db_session.close()
-    # app.dependency_overrides[get_original_db_dependency] = override_get_db
-    # For now, the direct patching of DATABASE_URL and re-init of SessionLocal
-    # in the modules themselves is the approach taken.
     return TestClient(app)
+
+@pytest.fixture(scope="session")
+def sid_for():
+    """
+    Returns a callable mapping a username to a session token, minted once per username.
+    Sessions live for hours, far longer than a test run, so the SIDs can be reused.
+    """
+    return lru_cache(maxsize=None)(create_test_session_for_app)
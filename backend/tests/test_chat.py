@@ -55,7 +55,7 @@ def get_auth_headers(username: str):
     return {"Authorization": f"Bearer {token}"}
 
 # Test fetching DMs successfully
-def test_get_direct_messages_success(client: TestClient, setup_chat_data, db: Session):
+def test_get_direct_messages_success(client: TestClient, setup_chat_data):
     user1 = setup_chat_data["user1"]
     user2 = setup_chat_data["user2"]
 
@@ -79,7 +79,7 @@ def test_get_direct_messages_success(client: TestClient, setup_chat_data, db: Se
     assert data[2]["sender"] == user1
 
 # Test fetching DMs when no messages exist
-def test_get_direct_messages_no_messages(client: TestClient, setup_chat_data, db: Session):
+def test_get_direct_messages_no_messages(client: TestClient, setup_chat_data):
     user1 = setup_chat_data["user1"]
     user3 = "nonexistentuser" # A user with no DMs with user1
 
@@ -95,7 +95,7 @@ def test_get_direct_messages_no_messages(client: TestClient, setup_chat_data, db
     assert len(data) == 0
 
 # Test pagination: limit
-def test_get_direct_messages_pagination_limit(client: TestClient, setup_chat_data, db: Session):
+def test_get_direct_messages_pagination_limit(client: TestClient, setup_chat_data):
     user1 = setup_chat_data["user1"]
     user2 = setup_chat_data["user2"]
 
@@ -150,7 +150,7 @@ def test_get_direct_messages_invalid_token(client: TestClient, setup_chat_data):
 # This is inherently covered by the endpoint logic, as it queries based on current_user.username
 # So, if user3 tries to get DMs for user2, it effectively asks for DMs between user3 and user2.
 # No special "forbidden" case, just gets DMs relevant to user3 and user2.
-def test_get_direct_messages_authorization(client: TestClient, setup_chat_data, db: Session):
+def test_get_direct_messages_authorization(client: TestClient, setup_chat_data):
     user1 = setup_chat_data["user1"]
     user2 = setup_chat_data["user2"]
     user3 = setup_chat_data["user3"]
@@ -186,8 +186,6 @@ def test_get_global_chat_messages(client: TestClient, setup_chat_data, db: SQLAl
     assert response.status_code == 200
     data = response.json()
 
-    global_messages_content = [msg["content"] for msg in data if msg["sender"] in ["testuser1", "testuser3"] and not msg.get("target")]
-
     # Expected global messages: "Global message from User3", "Global message from User1" (newest first)
     # The ChatMessageResponse model doesn't include 'target', so we filter by sender and known global content.
     # This test might need refinement based on how ChatMessageResponse is defined.
@@ -196,8 +194,9 @@ def test_get_global_chat_messages(client: TestClient, setup_chat_data, db: SQLAl
     # Filter out potential DM messages if the response model were to include them or target.
     # Here, we rely on the endpoint /api/chat to only return target=None messages.
 
-    assert "Global message from User3" in [m['content'] for m in data]
-    assert "Global message from User1" in [m['content'] for m in data]
+    contents = {m["content"] for m in data}
+    assert "Global message from User3" in contents
+    assert "Global message from User1" in contents
     # Check count of global messages based on setup
     db_global_messages = db.query(Chat).filter(Chat.target.is_(None)).count()
     assert len(data) == db_global_messages
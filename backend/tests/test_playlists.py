@@ -1,86 +1,74 @@
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session as SQLAlchemySession # Renamed to avoid clash
-from typing import Optional
+from pydantic import ValidationError
+from sqlalchemy.orm import Session as SQLAlchemySession # Renamed to avoid clash
 
+from backend.auth import session_manager
 from backend.main import app
+from backend.routes.playlists import PlaylistTrackCreate
 from backend.torb import models
-from backend.routes.preferences import get_db # For dependency override
-# Removed unused create_session_cookie, TestClient handles cookies via login.
-
-# Database setup for tests
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test_playlists.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-# Override get_db dependency for tests
-def override_get_db_for_playlists():
-    try:
-        db_session = TestingSessionLocal()
-        yield db_session
-    finally:
-        db_session.close()
-
-app.dependency_overrides[get_db] = override_get_db_for_playlists
-
-@pytest.fixture(scope="function", autouse=True)
-def setup_database_tables_fixture(): # Renamed to avoid clash if other test files have same name
-    models.Base.metadata.create_all(bind=engine)
-    yield
-    models.Base.metadata.drop_all(bind=engine)
-
-@pytest.fixture(scope="function")
-def db() -> SQLAlchemySession: # Use the renamed Session for type hint
-    db_session = TestingSessionLocal()
-    try:
-        yield db_session
-    finally:
-        db_session.close()
+
+# Engine, get_db override and the transactional `db` fixture live in conftest.py.
+# Every test runs inside its own rolled-back transaction, including API-only tests.
+pytestmark = pytest.mark.usefixtures("db_connection")
+
+# Primary test user (from users.json)
+USER1_USERNAME = "fabiomigueldp"
 
 # Helper to create tracks
 def create_test_track_in_db(db_session: SQLAlchemySession, uploader: str, title: str = "Test Track", uuid_suffix: str = "") -> models.Track:
     # Ensure unique UUID for each track if title is the same in multiple calls within a test
     track_uuid = f"test-uuid-{title.replace(' ', '-')}-{uuid_suffix if uuid_suffix else id(title)}"
     track = models.Track(uploader=uploader, title=title, status="ready", duration=180, uuid=track_uuid)
-    db_session.add(track)
-    db_session.commit()
-    db_session.refresh(track)
+    seed(db_session, track)
     return track
 
-# Authenticated client for 'fabiomigueldp'
-@pytest.fixture(scope="function")
-def client_user1() -> TestClient:
-    local_client = TestClient(app, base_url="http://testserver") # Explicit base_url
-    login_response = local_client.post("/api/login", json={"username": "fabiomigueldp", "password": "abc1d2aa"})
-    assert login_response.status_code == 200, f"Login failed for fabiomigueldp: {login_response.text}"
+# Helper to create several tracks with a single commit; specs are (title, uuid_suffix) pairs
+def create_test_tracks_in_db(db_session: SQLAlchemySession, uploader: str, specs: list[tuple[str, str]]) -> list[models.Track]:
+    tracks = [
+        models.Track(uploader=uploader, title=title, status="ready", duration=180, uuid=f"test-uuid-{title.replace(' ', '-')}-{suffix}")
+        for title, suffix in specs
+    ]
+    seed(db_session, *tracks)
+    return tracks
+
+# Helper to put tracks into a playlist directly, in order, with a single commit
+def seed_playlist_tracks(db_session: SQLAlchemySession, playlist_id: int, tracks: list[models.Track]) -> None:
+    db_session.add_all([models.PlaylistTrack(playlist_id=playlist_id, track_id=t.id, position=i + 1) for i, t in enumerate(tracks)])
+    db_session.commit()
 
-    # httpx.TestClient automatically handles cookies from responses for subsequent requests.
-    # The sid cookie from login_response is now in local_client.cookies.
-    # Debug print to confirm the contents of the cookie jar:
-    if hasattr(local_client.cookies, 'jar'):
-        print(f"client_user1 fixture: Cookies after login: {list(local_client.cookies.jar)}")
-    else: # Fallback for older httpx or different structure
-        print(f"client_user1 fixture: Cookies after login (dict): {dict(local_client.cookies)}")
+# Helper to insert arbitrary rows with a single commit, refreshed so their ids and defaults are loaded
+def seed(db_session: SQLAlchemySession, *objs):
+    db_session.add_all(objs)
+    db_session.commit()
+    for obj in objs:
+        db_session.refresh(obj)
+    return objs
 
+# Client carrying a session cookie minted directly by the app's session_manager, so tests
+# that don't exercise login skip the /api/login round-trip (and its preferences write).
+def authed_client(username: str) -> TestClient:
+    local_client = TestClient(app, base_url="http://testserver") # Explicit base_url
+    local_client.cookies.set("sid", session_manager.create_session(username))
     return local_client
 
-@pytest.fixture(scope="function")
-def user1_username() -> str:
-    return "fabiomigueldp"
+# Authenticated client for USER1_USERNAME, shared by every test in the module
+@pytest.fixture(scope="module")
+def client_user1() -> TestClient:
+    return authed_client(USER1_USERNAME)
 
 # Tests start here, using the fixtures defined above.
 # Removed create_test_user as users are from users.json.
-# Removed test_user_token and test_user_token_other as client_user1 and user1_username cover the primary test user.
+# Removed test_user_token and test_user_token_other as client_user1 and USER1_USERNAME cover the primary test user.
 # For 'other user' scenarios, data is created directly in DB with a different owner username.
 
 # Test Playlist CRUD
-def test_create_playlist(client_user1: TestClient, db: SQLAlchemySession, user1_username: str):
+def test_create_playlist(client_user1: TestClient, db: SQLAlchemySession):
     response = client_user1.post("/api/playlists", json={"name": "My Test Playlist", "is_shared": False})
     assert response.status_code == 201
     data = response.json()
     assert data["name"] == "My Test Playlist"
-    assert data["owner"] == user1_username
+    assert data["owner"] == USER1_USERNAME
     assert not data["is_shared"]
     assert "id" in data
     assert data["tracks"] == []
@@ -88,63 +76,56 @@ def test_create_playlist(client_user1: TestClient, db: SQLAlchemySession, user1_
     playlist_db = db.query(models.Playlist).filter(models.Playlist.id == data["id"]).first()
     assert playlist_db is not None
     assert playlist_db.name == "My Test Playlist"
-    assert playlist_db.owner == user1_username
+    assert playlist_db.owner == USER1_USERNAME
 
 def test_get_playlists_empty(client_user1: TestClient):
     response = client_user1.get("/api/playlists")
     assert response.status_code == 200
     assert response.json() == []
 
-def test_get_playlists_with_data(client_user1: TestClient, db: SQLAlchemySession, user1_username: str):
+def test_get_playlists_with_data(client_user1: TestClient, db: SQLAlchemySession):
     client_user1.post("/api/playlists", json={"name": "Playlist 1", "is_shared": False})
     client_user1.post("/api/playlists", json={"name": "Playlist Shared by User1", "is_shared": True})
 
     user2_db_username = "user2_owns_this"
     shared_by_user2 = models.Playlist(name="Shared by User2", owner=user2_db_username, is_shared=True)
     private_by_user2 = models.Playlist(name="Private by User2", owner=user2_db_username, is_shared=False)
-    db.add_all([shared_by_user2, private_by_user2])
-    db.commit()
+    seed(db, shared_by_user2, private_by_user2)
 
     response = client_user1.get("/api/playlists")
     assert response.status_code == 200
     data = response.json()
     assert len(data) == 3
 
-    names = sorted([p["name"] for p in data])
-    assert names == ["Playlist 1", "Playlist Shared by User1", "Shared by User2"]
-    for p_data in data:
-        if p_data["name"] == "Playlist 1":
-            assert p_data["owner"] == user1_username and not p_data["is_shared"]
-        elif p_data["name"] == "Playlist Shared by User1":
-            assert p_data["owner"] == user1_username and p_data["is_shared"]
-        elif p_data["name"] == "Shared by User2":
-            assert p_data["owner"] == user2_db_username and p_data["is_shared"]
-
-def test_get_single_playlist(client_user1: TestClient, db: SQLAlchemySession, user1_username: str):
+    by_name = {p["name"]: p for p in data}
+    assert sorted(by_name) == ["Playlist 1", "Playlist Shared by User1", "Shared by User2"]
+    assert by_name["Playlist 1"]["owner"] == USER1_USERNAME and not by_name["Playlist 1"]["is_shared"]
+    assert by_name["Playlist Shared by User1"]["owner"] == USER1_USERNAME and by_name["Playlist Shared by User1"]["is_shared"]
+    assert by_name["Shared by User2"]["owner"] == user2_db_username and by_name["Shared by User2"]["is_shared"]
+
+def test_get_single_playlist(client_user1: TestClient, db: SQLAlchemySession):
     create_res = client_user1.post("/api/playlists", json={"name": "Single View", "is_shared": False})
     playlist_id = create_res.json()["id"]
 
     response = client_user1.get(f"/api/playlists/{playlist_id}")
     assert response.status_code == 200
     data = response.json()
-    assert data["name"] == "Single View" and data["owner"] == user1_username and data["id"] == playlist_id
+    assert data["name"] == "Single View" and data["owner"] == USER1_USERNAME and data["id"] == playlist_id
 
-def test_get_single_playlist_shared_by_other(client_user1: TestClient, db: SQLAlchemySession, user1_username: str):
+def test_get_single_playlist_shared_by_other(client_user1: TestClient, db: SQLAlchemySession):
     user2_db_username = "user2_owns_shared_playlist"
     shared_playlist = models.Playlist(name="Another Shared", owner=user2_db_username, is_shared=True)
-    db.add(shared_playlist)
-    db.commit(); db.refresh(shared_playlist)
+    seed(db, shared_playlist)
 
     response = client_user1.get(f"/api/playlists/{shared_playlist.id}")
     assert response.status_code == 200
     data = response.json()
     assert data["name"] == "Another Shared" and data["owner"] == user2_db_username and data["is_shared"]
 
-def test_get_single_playlist_private_by_other_forbidden(client_user1: TestClient, db: SQLAlchemySession, user1_username: str):
+def test_get_single_playlist_private_by_other_forbidden(client_user1: TestClient, db: SQLAlchemySession):
     user2_db_username = "user2_owns_private_playlist"
     private_playlist = models.Playlist(name="Another Private", owner=user2_db_username, is_shared=False)
-    db.add(private_playlist)
-    db.commit(); db.refresh(private_playlist)
+    seed(db, private_playlist)
 
     response = client_user1.get(f"/api/playlists/{private_playlist.id}")
     assert response.status_code == 403
@@ -153,41 +134,47 @@ def test_get_nonexistent_playlist(client_user1: TestClient):
     response = client_user1.get("/api/playlists/99999")
     assert response.status_code == 404
 
-def test_update_playlist_name(client_user1: TestClient, db: SQLAlchemySession, user1_username: str):
-    create_res = client_user1.post("/api/playlists", json={"name": "Original", "is_shared": False})
-    playlist_id = create_res.json()["id"]
+# Private playlist owned by user1, inserted directly so PUT/DELETE tests skip the create round-trip
+@pytest.fixture
+def seeded_playlist(db: SQLAlchemySession) -> models.Playlist:
+    playlist = models.Playlist(name="seed", owner=USER1_USERNAME, is_shared=False)
+    seed(db, playlist)
+    # Detach it so the assertions' lookups read back what the API wrote, not the identity map
+    db.expunge(playlist)
+    return playlist
+
+def test_update_playlist_name(client_user1: TestClient, db: SQLAlchemySession, seeded_playlist: models.Playlist):
+    playlist_id = seeded_playlist.id
 
     response = client_user1.put(f"/api/playlists/{playlist_id}", json={"name": "Updated"})
     assert response.status_code == 200
     data = response.json()
     assert data["name"] == "Updated" and not data["is_shared"]
-    assert db.query(models.Playlist).get(playlist_id).name == "Updated"
+    assert db.get(models.Playlist, playlist_id).name == "Updated"
 
-def test_update_playlist_is_shared(client_user1: TestClient, db: SQLAlchemySession, user1_username: str):
-    create_res = client_user1.post("/api/playlists", json={"name": "To Share", "is_shared": False})
-    playlist_id = create_res.json()["id"]
+def test_update_playlist_is_shared(client_user1: TestClient, db: SQLAlchemySession, seeded_playlist: models.Playlist):
+    playlist_id = seeded_playlist.id
 
     response = client_user1.put(f"/api/playlists/{playlist_id}", json={"is_shared": True})
     assert response.status_code == 200
     data = response.json()
-    assert data["name"] == "To Share" and data["is_shared"]
-    assert db.query(models.Playlist).get(playlist_id).is_shared
+    assert data["name"] == "seed" and data["is_shared"]
+    assert db.get(models.Playlist, playlist_id).is_shared
 
-def test_update_playlist_partial(client_user1: TestClient, db: SQLAlchemySession, user1_username: str):
-    create_res = client_user1.post("/api/playlists", json={"name": "Partial Original", "is_shared": False})
-    playlist_id = create_res.json()["id"]
+def test_update_playlist_partial(client_user1: TestClient, db: SQLAlchemySession, seeded_playlist: models.Playlist):
+    playlist_id = seeded_playlist.id
 
     response = client_user1.put(f"/api/playlists/{playlist_id}", json={"name": "Partial Updated Name"})
     assert response.status_code == 200
     data = response.json()
     assert data["name"] == "Partial Updated Name" and not data["is_shared"]
-    db_playlist = db.query(models.Playlist).get(playlist_id)
+    db_playlist = db.get(models.Playlist, playlist_id)
     assert db_playlist.name == "Partial Updated Name" and not db_playlist.is_shared
 
-def test_update_playlist_by_non_owner_forbidden(client_user1: TestClient, db: SQLAlchemySession, user1_username: str):
+def test_update_playlist_by_non_owner_forbidden(client_user1: TestClient, db: SQLAlchemySession):
     user2_db_username = "owner_of_playlist_to_update"
     owned_pl = models.Playlist(name="Owned PL", owner=user2_db_username, is_shared=False)
-    db.add(owned_pl); db.commit(); db.refresh(owned_pl)
+    seed(db, owned_pl)
 
     response = client_user1.put(f"/api/playlists/{owned_pl.id}", json={"name": "Update Attempt"})
     assert response.status_code == 403
@@ -197,31 +184,30 @@ def test_update_playlist_by_non_owner_forbidden(client_user1: TestClient, db: SQ
     response = client_user1.put(f"/api/playlists/{owned_pl.id}", json={"name": "Update Shared Attempt"})
     assert response.status_code == 403 # Still forbidden for non-owner to modify
 
-def test_delete_playlist(client_user1: TestClient, db: SQLAlchemySession, user1_username: str):
-    create_res = client_user1.post("/api/playlists", json={"name": "To Delete", "is_shared": False})
-    playlist_id = create_res.json()["id"]
+def test_delete_playlist(client_user1: TestClient, db: SQLAlchemySession, seeded_playlist: models.Playlist):
+    playlist_id = seeded_playlist.id
 
     response = client_user1.delete(f"/api/playlists/{playlist_id}")
     assert response.status_code == 204
-    assert db.query(models.Playlist).get(playlist_id) is None
+    assert db.get(models.Playlist, playlist_id) is None
     assert client_user1.get(f"/api/playlists/{playlist_id}").status_code == 404
 
-def test_delete_playlist_by_non_owner_forbidden(client_user1: TestClient, db: SQLAlchemySession, user1_username: str):
+def test_delete_playlist_by_non_owner_forbidden(client_user1: TestClient, db: SQLAlchemySession):
     user2_db_username = "owner_of_playlist_to_delete"
     owned_pl = models.Playlist(name="Owned PL Del", owner=user2_db_username, is_shared=False)
-    db.add(owned_pl); db.commit(); db.refresh(owned_pl)
+    seed(db, owned_pl)
 
     response = client_user1.delete(f"/api/playlists/{owned_pl.id}")
     assert response.status_code == 403
-    assert db.query(models.Playlist).get(owned_pl.id) is not None
+    assert db.get(models.Playlist, owned_pl.id, populate_existing=True) is not None
 
 
 # Test Playlist Tracks
 @pytest.fixture
-def fixture_playlist_with_tracks(db: SQLAlchemySession, user1_username: str, client_user1: TestClient): # Renamed
-    track1 = create_test_track_in_db(db, uploader=user1_username, title="Track Alpha", uuid_suffix="alpha")
-    track2 = create_test_track_in_db(db, uploader=user1_username, title="Track Beta", uuid_suffix="beta")
-    track3 = create_test_track_in_db(db, uploader=user1_username, title="Track Gamma", uuid_suffix="gamma")
+def fixture_playlist_with_tracks(db: SQLAlchemySession, client_user1: TestClient): # Renamed
+    track1, track2, track3 = create_test_tracks_in_db(
+        db, uploader=USER1_USERNAME, specs=[("Track Alpha", "alpha"), ("Track Beta", "beta"), ("Track Gamma", "gamma")]
+    )
 
     playlist_res = client_user1.post("/api/playlists", json={"name": "Tracks Test PL", "is_shared": False})
     assert playlist_res.status_code == 201
@@ -249,18 +235,18 @@ def test_add_track_to_playlist(client_user1: TestClient, db: SQLAlchemySession,
 
 def test_add_track_to_playlist_invalid_position(client_user1: TestClient, fixture_playlist_with_tracks): # Renamed
     playlist_id, track1, _, _ = fixture_playlist_with_tracks
-    assert client_user1.post(f"/api/playlists/{playlist_id}/tracks", json={"track_id": track1.id, "position": 0}).status_code == 422
-        # The next line's expectation might change based on whether the 400 is correctly raised now.
-        # If it was returning 201 incorrectly, and now returns 200 incorrectly (if 400 not raised), this test still fails.
-        # The goal is for it to correctly return 400.
+    # position=0 is rejected by the request model itself (gt=0), no HTTP round-trip needed
+    with pytest.raises(ValidationError):
+        PlaylistTrackCreate(track_id=track1.id, position=0)
+    # Out of range for the current playlist is a business rule and needs the DB state
     assert client_user1.post(f"/api/playlists/{playlist_id}/tracks", json={"track_id": track1.id, "position": 5}).status_code == 400
 
 def test_add_nonexistent_track_to_playlist(client_user1: TestClient, fixture_playlist_with_tracks): # Renamed
     playlist_id, _, _, _ = fixture_playlist_with_tracks
     assert client_user1.post(f"/api/playlists/{playlist_id}/tracks", json={"track_id": 9999, "position": 1}).status_code == 404
 
-def test_add_track_to_nonexistent_playlist(client_user1: TestClient, db: SQLAlchemySession, user1_username: str):
-    track = create_test_track_in_db(db, uploader=user1_username, uuid_suffix="nonexistpl")
+def test_add_track_to_nonexistent_playlist(client_user1: TestClient, db: SQLAlchemySession):
+    track = create_test_track_in_db(db, uploader=USER1_USERNAME, uuid_suffix="nonexistpl")
     assert client_user1.post("/api/playlists/9999/tracks", json={"track_id": track.id, "position": 1}).status_code == 404
 
 def test_add_or_reorder_track_existing_is_reorder(client_user1: TestClient, fixture_playlist_with_tracks): # Renamed
@@ -277,9 +263,7 @@ def test_add_or_reorder_track_existing_is_reorder(client_user1: TestClient, fixt
 
 def test_reorder_track_in_playlist(client_user1: TestClient, db: SQLAlchemySession, fixture_playlist_with_tracks): # Renamed
     playlist_id, track1, track2, track3 = fixture_playlist_with_tracks
-    client_user1.post(f"/api/playlists/{playlist_id}/tracks", json={"track_id": track1.id, "position": 1})
-    client_user1.post(f"/api/playlists/{playlist_id}/tracks", json={"track_id": track2.id, "position": 2})
-    client_user1.post(f"/api/playlists/{playlist_id}/tracks", json={"track_id": track3.id, "position": 3})
+    seed_playlist_tracks(db, playlist_id, [track1, track2, track3])
 
     res_reorder_t1 = client_user1.post(f"/api/playlists/{playlist_id}/tracks", json={"track_id": track1.id, "position": 3})
     assert res_reorder_t1.status_code == 200
@@ -299,19 +283,16 @@ def test_reorder_track_in_playlist(client_user1: TestClient, db: SQLAlchemySessi
     assert tracks[1]["track_id"] == track2.id and tracks[1]["position"] == 2
     assert tracks[2]["track_id"] == track1.id and tracks[2]["position"] == 3
 
-def test_reorder_track_invalid_position(client_user1: TestClient, fixture_playlist_with_tracks): # Renamed
+def test_reorder_track_invalid_position(client_user1: TestClient, db: SQLAlchemySession, fixture_playlist_with_tracks): # Renamed
     playlist_id, track1, track2 = fixture_playlist_with_tracks[0:3:1] # Get first two tracks
-    client_user1.post(f"/api/playlists/{playlist_id}/tracks", json={"track_id": track1.id, "position": 1})
-    client_user1.post(f"/api/playlists/{playlist_id}/tracks", json={"track_id": track2.id, "position": 2})
+    seed_playlist_tracks(db, playlist_id, [track1, track2])
 
     assert client_user1.post(f"/api/playlists/{playlist_id}/tracks", json={"track_id": track1.id, "position": 0}).status_code == 422
     assert client_user1.post(f"/api/playlists/{playlist_id}/tracks", json={"track_id": track1.id, "position": 3}).status_code == 400
 
 def test_remove_track_from_playlist(client_user1: TestClient, db: SQLAlchemySession, fixture_playlist_with_tracks): # Renamed
     playlist_id, track1, track2, track3 = fixture_playlist_with_tracks
-    client_user1.post(f"/api/playlists/{playlist_id}/tracks", json={"track_id": track1.id, "position": 1})
-    client_user1.post(f"/api/playlists/{playlist_id}/tracks", json={"track_id": track2.id, "position": 2})
-    client_user1.post(f"/api/playlists/{playlist_id}/tracks", json={"track_id": track3.id, "position": 3})
+    seed_playlist_tracks(db, playlist_id, [track1, track2, track3])
 
     assert client_user1.delete(f"/api/playlists/{playlist_id}/tracks/{track2.id}").status_code == 204
     tracks = client_user1.get(f"/api/playlists/{playlist_id}").json()["tracks"]
@@ -330,36 +311,37 @@ def test_remove_nonexistent_track_from_playlist(client_user1: TestClient, fixtur
     playlist_id, _, _, _ = fixture_playlist_with_tracks
     assert client_user1.delete(f"/api/playlists/{playlist_id}/tracks/9999").status_code == 404
 
-def test_add_or_reorder_track_by_non_owner_forbidden(client_user1: TestClient, db: SQLAlchemySession, user1_username: str): # Changed test_user_token to user1_username
+def test_add_or_reorder_track_by_non_owner_forbidden(client_user1: TestClient, db: SQLAlchemySession):
     user2_db_username = "track_owner_forbidden_test"
     owned_pl = models.Playlist(name="User2 PL Tracks Forbidden", owner=user2_db_username, is_shared=False)
-    track_to_add = create_test_track_in_db(db, uploader=user2_db_username, title="User2 Track Forbidden", uuid_suffix="forbiddenadd")
-    db.add(owned_pl); db.commit(); db.refresh(owned_pl)
+    track_to_add = models.Track(uploader=user2_db_username, title="User2 Track Forbidden", status="ready", duration=180, uuid="test-uuid-User2-Track-Forbidden-forbiddenadd")
+    seed(db, owned_pl, track_to_add)
 
     response = client_user1.post(f"/api/playlists/{owned_pl.id}/tracks", json={"track_id": track_to_add.id, "position": 1})
     assert response.status_code == 403
 
-def test_remove_track_by_non_owner_forbidden(client_user1: TestClient, db: SQLAlchemySession, user1_username: str): # Changed test_user_token to user1_username
+def test_remove_track_by_non_owner_forbidden(client_user1: TestClient, db: SQLAlchemySession):
     user2_db_username = "track_remove_forbidden_test"
+    # Playlist, track and its playlist entry for user2_db_username, seeded in one commit
+    track_in_pl = models.Track(uploader=user2_db_username, title="Track To Remove Forbidden", status="ready", duration=180, uuid="test-uuid-Track-To-Remove-Forbidden-forbiddenremove")
     owned_pl = models.Playlist(name="User2 PL Remove Forbidden", owner=user2_db_username, is_shared=False)
-    track_in_pl = create_test_track_in_db(db, uploader=user2_db_username, title="Track To Remove Forbidden", uuid_suffix="forbiddenremove")
-    db.add(owned_pl); db.commit(); db.refresh(owned_pl)
-
-    # Add track to playlist directly in DB for setup as user2_db_username
-    pt_entry = models.PlaylistTrack(playlist_id=owned_pl.id, track_id=track_in_pl.id, position=1)
-    db.add(pt_entry); db.commit()
+    owned_pl.tracks.append(models.PlaylistTrack(track=track_in_pl, position=1))
+    seed(db, owned_pl, track_in_pl)
 
     response = client_user1.delete(f"/api/playlists/{owned_pl.id}/tracks/{track_in_pl.id}")
     assert response.status_code == 403
 
 # Authentication tests for main playlist endpoints
-def test_create_playlist_unauthenticated(db: SQLAlchemySession): # db fixture for table setup
-    unauth_client = TestClient(app)
+@pytest.fixture(scope="module")
+def unauth_client() -> TestClient:
+    with TestClient(app) as c:
+        yield c
+
+def test_create_playlist_unauthenticated(unauth_client: TestClient):
     response = unauth_client.post("/api/playlists", json={"name": "Unauth PL", "is_shared": False})
     assert response.status_code == 401
 
-def test_get_playlists_unauthenticated(db: SQLAlchemySession): # db fixture for table setup
-    unauth_client = TestClient(app)
+def test_get_playlists_unauthenticated(unauth_client: TestClient):
     response = unauth_client.get("/api/playlists")
     assert response.status_code == 401
 
@@ -1,58 +1,30 @@
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import Session
 from backend.main import app, get_current_user # Main FastAPI app & get_current_user for override
-from backend.torb.models import Base, UserPreference # UserPreference model
+from backend.torb.models import UserPreference # UserPreference model
 from backend.auth import User # User model for mocking get_current_user return type
-from backend.routes.preferences import get_db # get_db dependency
-
-# Use a separate test database
-DATABASE_URL = "sqlite:///./test_preferences.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-# Dependency override for get_db
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
-        yield db
-    finally:
-        db.close()
-
-# Fixture to create tables and drop them after test session
-@pytest.fixture(scope="session", autouse=True)
-def setup_db():
-    Base.metadata.create_all(bind=engine) # Create tables
-    yield
-    Base.metadata.drop_all(bind=engine) # Drop tables after tests
-
-# Fixture to provide a database session for each test
-@pytest.fixture(scope="function")
-def db_session(setup_db):
-    connection = engine.connect()
-    transaction = connection.begin()
-    session = TestingSessionLocal(bind=connection)
-    yield session
-    session.close()
-    transaction.rollback()
-    connection.close()
-
-# Fixture for the TestClient
-@pytest.fixture(scope="module")
-def client():
-    app.dependency_overrides[get_db] = override_get_db
-    with TestClient(app) as c:
-        yield c
-    # Clear overrides after yielding the client, not globally for the app
-    # This is important if other test modules use the same app but different overrides
-    app.dependency_overrides.pop(get_db, None)
 
+# The shared in-memory engine, get_db override, `db` session and `client` fixtures
+# come from conftest.py.
 
 # Mock get_current_user dependency
 def mock_get_current_user_testuser():
     return User(username="testuser", is_admin=False)
 
+# Fixture that authenticates requests as "testuser" and restores any previous override
+@pytest.fixture
+def as_testuser():
+    prev = app.dependency_overrides.get(get_current_user)
+    app.dependency_overrides[get_current_user] = mock_get_current_user_testuser
+    try:
+        yield
+    finally:
+        if prev is None:
+            app.dependency_overrides.pop(get_current_user, None)
+        else:
+            app.dependency_overrides[get_current_user] = prev
+
 @pytest.mark.parametrize("initial_prefs_exist, new_theme, new_muted_uploaders, expected_theme, expected_muted_uploaders", [
     (False, "neon", ["uploader1", "uploader2"], "neon", ["uploader1", "uploader2"]), # No initial prefs
     (True, "vaporwave", [], "vaporwave", []), # Initial prefs exist, new muted_uploaders is empty list
@@ -61,25 +33,22 @@ def mock_get_current_user_testuser():
 ])
 def test_put_update_user_preferences(
     client: TestClient,
-    db_session: Session,
+    db: Session,
+    as_testuser,
     initial_prefs_exist: bool,
     new_theme: str,
     new_muted_uploaders: list[str] | None,
     expected_theme: str,
     expected_muted_uploaders: list[str]
 ):
-    # Override the get_current_user dependency for this specific test or test module
-    original_get_current_user = app.dependency_overrides.get(get_current_user)
-    app.dependency_overrides[get_current_user] = mock_get_current_user_testuser
-
     username = "testuser"
     initial_theme = "synthwave"
     initial_muted = ["existing_uploader"]
 
     if initial_prefs_exist:
         existing_pref = UserPreference(username=username, theme=initial_theme, muted_uploaders=initial_muted)
-        db_session.add(existing_pref)
-        db_session.commit()
+        db.add(existing_pref)
+        db.commit()
 
     payload = {"theme": new_theme}
     if new_muted_uploaders is not None:
@@ -98,7 +67,8 @@ def test_put_update_user_preferences(
         assert data["muted_uploaders"] == expected_muted_uploaders
 
     # Verify in DB
-    db_pref = db_session.query(UserPreference).filter(UserPreference.username == username).one_or_none()
+    # populate_existing: the seeded row is still in the identity map and not expired by commit
+    db_pref = db.query(UserPreference).filter(UserPreference.username == username).populate_existing().one_or_none()
     assert db_pref is not None
     assert db_pref.theme == expected_theme
     if new_muted_uploaders is None and initial_prefs_exist:
@@ -106,34 +76,26 @@ def test_put_update_user_preferences(
     else:
         assert db_pref.muted_uploaders == expected_muted_uploaders
 
-    # Clean up dependency override for get_current_user
-    if original_get_current_user is not None:
-        app.dependency_overrides[get_current_user] = original_get_current_user
-    else:
-        app.dependency_overrides.pop(get_current_user, None)
+
+# Timing for the preferences PUT path (ORM + JSON column). Benchmarks are disabled by default
+# and run once as a plain test; opt in with `pytest -p no:xdist --benchmark-enable`.
+@pytest.mark.benchmark(group="preferences")
+def test_put_update_user_preferences_benchmark(client: TestClient, db_connection, as_testuser, benchmark):
+    def setup():
+        # Build the request outside the timed call so only the PUT round-trip is measured
+        return (), {"json": {"theme": "neon", "muted_uploaders": ["uploader1"]}}
+
+    response = benchmark.pedantic(lambda **kwargs: client.put("/api/preferences", **kwargs), setup=setup, rounds=50, warmup_rounds=5)
+    assert response.status_code == 200
 
 
-def test_login_creates_default_preferences(client: TestClient, db_session: Session):
+def test_login_creates_default_preferences(client: TestClient, db: Session):
     # Using "testuser" and "testpassword" as per simplified approach, assuming they exist in users.json
     login_username = "testuser"
     login_password = "testpassword"
 
     login_payload = {"username": login_username, "password": login_password}
 
-    # Ensure no preferences exist for this user beforehand in this test's session
-    # The db_session fixture ensures a clean transaction for each test.
-    # However, we can explicitly delete if a previous test in the same session somehow created it
-    # (though with function scope, this shouldn't happen).
-    # For safety and clarity:
-    existing_prefs_setup = db_session.query(UserPreference).filter(UserPreference.username == login_username).one_or_none()
-    if existing_prefs_setup:
-        db_session.delete(existing_prefs_setup)
-        db_session.commit()
-        # Re-query to confirm deletion or ensure it's not in the session cache
-        existing_prefs_setup = db_session.query(UserPreference).filter(UserPreference.username == login_username).one_or_none()
-
-    assert existing_prefs_setup is None, f"Preferences for {login_username} should not exist before login test"
-
     # Call the login endpoint
     # LoginRequest Pydantic model implies json payload, not form data
     response = client.post("/api/login", json=login_payload)
@@ -141,11 +103,11 @@ def test_login_creates_default_preferences(client: TestClient, db_session: Sessi
     assert response.status_code == 200, f"Login failed for user '{login_username}'. Response: {response.text}"
 
     # Verify preferences were created in the DB
-    pref_record = db_session.query(UserPreference).filter(UserPreference.username == login_username).one_or_none()
+    pref_record = db.query(UserPreference).filter(UserPreference.username == login_username).one_or_none()
 
     assert pref_record is not None, f"Preferences for {login_username} were not created after login"
     assert pref_record.theme == "synthwave", f"Default theme for {login_username} is not 'synthwave', found '{pref_record.theme}'"
     assert pref_record.muted_uploaders == [], f"Default muted_uploaders for {login_username} is not an empty list, found '{pref_record.muted_uploaders}'"
 
-    # The db_session fixture will roll back this transaction, so the created preference will be removed.
+    # The db fixture will roll back this transaction, so the created preference will be removed.
     # No explicit cleanup of the UserPreference record is strictly needed here due to fixture's rollback.
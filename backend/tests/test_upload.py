@@ -1,24 +1,43 @@
 import asyncio
+import os
 import shutil
 from pathlib import Path
-import time
 
+import httpx
 import pytest
+import pytest_asyncio
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, Session
 
 from backend.main import app # Main FastAPI app
 from backend.torb.models import Base, Track
 from backend.routes.preferences import get_db as app_get_db # The get_db used by the app
-from backend.tests.utils import generate_test_mp3 # Utility to generate test audio
+from backend.routes import upload as upload_route
+from backend.tests.utils import generate_test_mp3, generate_test_mp3s_async # Utilities to generate test audio
 from backend.auth import User, get_current_user # For overriding dependencies
 
-# Test database setup
-DATABASE_URL = "sqlite:///./test_upload.db"
+# All tests share the module's upload dirs, so keep them on one xdist worker
+pytestmark = pytest.mark.xdist_group("upload")
+
+# Test database setup: named shared-cache in-memory database. The test thread and the portal
+# thread running upload processing both use it, so each thread gets its own connection
+# (SQLAlchemy's default SingletonThreadPool for in-memory SQLite); the shared cache makes
+# them all see one database.
+DATABASE_URL = "sqlite:///file:test_upload?mode=memory&cache=shared&uri=true"
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False}) # check_same_thread for SQLite
 TestSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Wait on a busy lock instead of failing, and keep a larger page cache. WAL is not set: an
+# in-memory database always uses the memory journal.
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA cache_size=-32000")
+    cursor.close()
+
 # Dependency override for get_db
 def override_get_db():
     try:
@@ -28,8 +47,9 @@ def override_get_db():
         db.close()
 
 # --- AC-3: CPU Load Test (Parallel Uploads) ---
-@pytest.mark.asyncio # Pytest-asyncio might be needed for this if using async client calls directly
-async def test_parallel_uploads_succeed(authenticated_client: TestClient, temp_upload_media_dirs):
+@pytest.mark.slow
+@pytest.mark.asyncio
+async def test_parallel_uploads_succeed(async_authenticated_client: httpx.AsyncClient, temp_upload_media_dirs, track_processed):
     """
     Tests that two uploads initiated in parallel can both complete successfully.
     This is a basic check for concurrent processing.
@@ -37,62 +57,48 @@ async def test_parallel_uploads_succeed(authenticated_client: TestClient, temp_u
     local_files_dir, _, _ = temp_upload_media_dirs
 
     # Prepare two different files and titles
-    test_mp3_path1 = generate_test_mp3(local_files_dir, "parallel_test1.mp3", duration_seconds=1)
+    test_mp3_path1, test_mp3_path2 = await generate_test_mp3s_async(
+        [(local_files_dir / "parallel_test1.mp3", 1), (local_files_dir / "parallel_test2.mp3", 1)]
+    )
     test_cover_path1 = local_files_dir / "parallel_cover1.jpg"
     with open(test_cover_path1, "wb") as f:
         f.write(b"pcover1")
 
-    test_mp3_path2 = generate_test_mp3(local_files_dir, "parallel_test2.mp3", duration_seconds=1)
     test_cover_path2 = local_files_dir / "parallel_cover2.jpg"
     with open(test_cover_path2, "wb") as f:
         f.write(b"pcover2")
 
     # Define an async function to upload and poll for one track
     async def upload_and_poll(title: str, audio_path: Path, cover_path: Path) -> dict:
-        # authenticated_client is synchronous, so we run its methods in a thread pool
-        # to make them awaitable in this async test function.
-        # Alternatively, use an async TestClient like httpx.AsyncClient if app is setup for it.
-        # For now, TestClient from FastAPI is sync.
-
-        loop = asyncio.get_event_loop()
-
-        def _upload():
-            with open(audio_path, "rb") as af, open(cover_path, "rb") as cf:
-                return authenticated_client.post(
-                    "/api/upload",
-                    data={"title": title},
-                    files={"file": (audio_path.name, af, "audio/mpeg"), "cover": (cover_path.name, cf, "image/jpeg")}
-                )
-
-        response = await loop.run_in_executor(None, _upload)
+        # The async client drives the app on this event loop, so both uploads overlap without threads
+        # Fixture files are a few KB: send them as bytes rather than streaming open file handles
+        response = await async_authenticated_client.post(
+            "/api/upload",
+            data={"title": title},
+            files={"file": (audio_path.name, audio_path.read_bytes(), "audio/mpeg"), "cover": (cover_path.name, cover_path.read_bytes(), "image/jpeg")}
+        )
         assert response.status_code == 200
         upload_data = response.json()
         track_id = upload_data["track_id"]
         assert upload_data["status"] == "processing"
 
         max_wait_time = 45  # Increased wait time for parallel processing
-        poll_interval = 1
-        start_time = time.time()
-
-        while time.time() - start_time < max_wait_time:
-            def _poll():
-                return authenticated_client.get(f"/api/upload/status/{track_id}")
+        try:
+            await asyncio.wait_for(track_processed(track_id), timeout=max_wait_time)
+        except asyncio.TimeoutError:
+            pytest.fail(f"Track '{title}' did not become ready within {max_wait_time} seconds.")
 
-            status_response = await loop.run_in_executor(None, _poll)
-            assert status_response.status_code == 200
-            current_status_data = status_response.json()
-
-            if current_status_data["status"] == "ready":
-                # Verify HLS files for this track (simplified check for brevity)
-                track_uuid_poll = current_status_data["uuid"]
-                master_m3u8_path_poll = Path("/media") / track_uuid_poll / "master.m3u8"
-                assert master_m3u8_path_poll.exists(), f"Master playlist for {title} not found at {master_m3u8_path_poll}"
-                return current_status_data
-            elif current_status_data["status"] == "error":
-                pytest.fail(f"Track '{title}' processing failed: {current_status_data}")
-            await asyncio.sleep(poll_interval) # Use asyncio.sleep in async def
+        status_response = await async_authenticated_client.get(f"/api/upload/status/{track_id}")
+        assert status_response.status_code == 200
+        current_status_data = status_response.json()
+        if current_status_data["status"] == "error":
+            pytest.fail(f"Track '{title}' processing failed: {current_status_data}")
 
-        pytest.fail(f"Track '{title}' did not become ready within {max_wait_time} seconds.")
+        # Verify HLS files for this track (simplified check for brevity)
+        track_uuid_poll = current_status_data["uuid"]
+        master_m3u8_path_poll = Path("/media") / track_uuid_poll / "master.m3u8"
+        assert master_m3u8_path_poll.exists(), f"Master playlist for {title} not found at {master_m3u8_path_poll}"
+        return current_status_data
 
 
     # Run two upload_and_poll tasks concurrently
@@ -109,23 +115,31 @@ async def test_parallel_uploads_succeed(authenticated_client: TestClient, temp_u
 
     print("Both parallel uploads completed successfully.")
 
-# Fixture for a test client
+# Fixture for a test client. Module-scoped on purpose: its get_db override points the app at
+# this module's database and must be undone before other modules run on the same worker.
 @pytest.fixture(scope="module")
 def client():
     # Create tables for the test DB
     Base.metadata.create_all(bind=engine)
+    prev = app.dependency_overrides.get(app_get_db)
     app.dependency_overrides[app_get_db] = override_get_db
 
-    with TestClient(app) as c:
+    # Background processing opens its own sessions from preferences.SessionLocal
+    with pytest.MonkeyPatch.context() as mp, TestClient(app) as c:
+        mp.setattr("backend.routes.preferences.SessionLocal", TestSessionLocal)
         yield c
 
-    # Teardown: remove test DB and clean overrides
+    # Teardown: drop the test tables and clean overrides
     Base.metadata.drop_all(bind=engine)
-    Path("./test_upload.db").unlink(missing_ok=True)
-    app.dependency_overrides = {}
+    app.dependency_overrides.pop(get_current_user, None)
+    if prev is None:
+        app.dependency_overrides.pop(app_get_db, None)
+    else:
+        app.dependency_overrides[app_get_db] = prev
 
 
-# Fixture to provide an authenticated client
+# Fixture to provide an authenticated client. Stays function-scoped: unauthenticated_client
+# removes the get_current_user override, so it has to be re-applied per test.
 @pytest.fixture
 def authenticated_client(client: TestClient):
     # Mock get_current_user to return a test user
@@ -138,6 +152,45 @@ def authenticated_client(client: TestClient):
     return client
 
 
+# Session on the module's test database, for assertions on what the app wrote
+@pytest.fixture
+def db_session(client: TestClient):
+    db = TestSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# Waits for a track's processing to end, i.e. for its final status ("ready" or "error"), without
+# polling /api/upload/status: the background task is wrapped to signal when it returns. Awaited
+# on the loop that runs the app's background tasks.
+@pytest.fixture
+def track_processed(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    done: dict[int, asyncio.Event] = {}
+    process = upload_route.process_audio_to_hls
+
+    async def process_and_signal(track_id: int, *args):
+        try:
+            await process(track_id, *args)
+        finally:
+            done.setdefault(track_id, asyncio.Event()).set()
+
+    monkeypatch.setattr(upload_route, "process_audio_to_hls", process_and_signal)
+
+    async def wait(track_id: int) -> None:
+        await done.setdefault(track_id, asyncio.Event()).wait()
+
+    return wait
+
+
+# Async variant of authenticated_client, for tests that issue concurrent requests
+@pytest_asyncio.fixture
+async def async_authenticated_client(authenticated_client: TestClient):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as ac:
+        yield ac
+
+
 # Fixture to provide an unauthenticated client (no overrides for get_current_user)
 @pytest.fixture
 def unauthenticated_client(client: TestClient):
@@ -147,7 +200,7 @@ def unauthenticated_client(client: TestClient):
     return client
 
 # Temporary directory for test uploads and media
-@pytest.fixture(scope="module")
+@pytest.fixture(scope="session")
 def temp_upload_media_dirs():
     base_temp_dir = Path("./temp_test_data_upload_module")
     test_uploads_dir = base_temp_dir / "uploads"
@@ -192,7 +245,7 @@ def temp_upload_media_dirs():
 def test_upload_track_unauthenticated(unauthenticated_client: TestClient, temp_upload_media_dirs):
     """Test POST /api/upload without authentication."""
     local_files_dir, _, _ = temp_upload_media_dirs
-    test_mp3_path = generate_test_mp3(local_files_dir, "auth_test.mp3")
+    test_mp3_path = generate_test_mp3(local_files_dir, "auth_test.mp3", duration_seconds=1)
     test_cover_path = local_files_dir / "cover.jpg"
     with open(test_cover_path, "wb") as f:
         f.write(b"fake cover data")
@@ -242,25 +295,31 @@ def test_get_upload_status_unauthenticated(unauthenticated_client: TestClient):
 # These paths might need to be actual temporary directories for testing.
 
 # Let's add a fixture to clean up /uploads and /media content if they are used by tests.
+def _purge(root: str) -> None:
+    """Empties root (keeping root itself) with one scandir pass per directory, using dirent types."""
+    if not os.path.isdir(root):
+        return
+    stack = [(root, False)]
+    while stack:
+        path, drained = stack.pop()
+        if drained:
+            if path != root:
+                os.rmdir(path)
+            continue
+        stack.append((path, True)) # Revisit once its children are gone
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, False))
+                else:
+                    os.unlink(entry.path)
+
 @pytest.fixture(autouse=True) # autouse to ensure it runs for all tests in this module
 def cleanup_app_upload_media_dirs():
     # These are the paths hardcoded in backend/routes/upload.py
-    app_upload_dir = Path("/uploads")
-    app_media_dir = Path("/media")
-
     def _cleanup():
-        if app_upload_dir.exists():
-            for item in app_upload_dir.iterdir():
-                if item.is_dir(): # Assuming track_uuid subdirs
-                    shutil.rmtree(item)
-                else:
-                    item.unlink() # Just in case
-        if app_media_dir.exists():
-             for item in app_media_dir.iterdir():
-                if item.is_dir(): # Assuming track_uuid subdirs
-                    shutil.rmtree(item)
-                else:
-                    item.unlink()
+        _purge("/uploads")
+        _purge("/media")
 
     _cleanup() # Cleanup before test
     yield
@@ -277,7 +336,8 @@ def cleanup_app_upload_media_dirs():
 # And then AC-2 and AC-3.
 
 # --- AC-2: Integration Test for Upload, Processing, and HLS structure ---
-def test_upload_and_processing_pipeline_success(authenticated_client: TestClient, temp_upload_media_dirs):
+@pytest.mark.slow
+def test_upload_and_processing_pipeline_success(authenticated_client: TestClient, db_session: Session, temp_upload_media_dirs, track_processed):
     """
     Tests the full upload pipeline:
     1. Upload a generated MP3 and a cover.
@@ -312,24 +372,18 @@ def test_upload_and_processing_pipeline_success(authenticated_client: TestClient
     assert track_id is not None
     assert track_uuid is not None
 
-    # Poll for status
+    # Wait for processing on the app's event loop (the client's portal), then read the status once
     max_wait_time = 30  # seconds, FFmpeg can take a bit
-    poll_interval = 1
-    start_time = time.time()
-    final_status_data = None
+    try:
+        authenticated_client.portal.call(asyncio.wait_for, track_processed(track_id), max_wait_time)
+    except asyncio.TimeoutError:
+        pytest.fail(f"Track did not become ready within {max_wait_time} seconds.")
 
-    while time.time() - start_time < max_wait_time:
-        status_response = authenticated_client.get(f"/api/upload/status/{track_id}")
-        assert status_response.status_code == 200
-        current_status_data = status_response.json()
-        if current_status_data["status"] == "ready":
-            final_status_data = current_status_data
-            break
-        elif current_status_data["status"] == "error":
-            pytest.fail(f"Track processing failed with error status: {current_status_data}")
-        time.sleep(poll_interval)
-    else:
-        pytest.fail(f"Track did not become ready within {max_wait_time} seconds. Last status: {current_status_data['status']}")
+    status_response = authenticated_client.get(f"/api/upload/status/{track_id}")
+    assert status_response.status_code == 200
+    final_status_data = status_response.json()
+    if final_status_data["status"] == "error":
+        pytest.fail(f"Track processing failed with error status: {final_status_data}")
 
     assert final_status_data is not None
     assert final_status_data["status"] == "ready"
@@ -357,32 +411,38 @@ def test_upload_and_processing_pipeline_success(authenticated_client: TestClient
     assert "BANDWIDTH=128000" in master_content
     assert "BANDWIDTH=256000" in master_content
 
+    # One directory listing per level: bitrate dirs, then playlist + segments inside each
     expected_bitrates = ["64k", "128k", "256k"]
+    with os.scandir(track_media_path) as entries:
+        bitrate_dirs = {entry.name: entry.path for entry in entries if entry.is_dir()}
     for br in expected_bitrates:
-        br_playlist_path = track_media_path / br / "playlist.m3u8"
-        assert br_playlist_path.exists(), f"Bitrate playlist {br_playlist_path} not found"
-        with open(br_playlist_path, "r") as f:
-            br_content = f.read()
+        assert br in bitrate_dirs, f"Bitrate directory {track_media_path / br} not found"
+        has_playlist = False
+        segment_sizes = {}
+        with os.scandir(bitrate_dirs[br]) as entries:
+            for entry in entries:
+                if entry.name == "playlist.m3u8":
+                    has_playlist = True
+                elif entry.name.startswith("segment") and entry.name.endswith(".ts"):
+                    segment_sizes[entry.name] = entry.stat().st_size
+
+        br_playlist_path = Path(bitrate_dirs[br], "playlist.m3u8")
+        assert has_playlist, f"Bitrate playlist {br_playlist_path} not found"
+        br_content = br_playlist_path.read_text()
         assert "#EXTM3U" in br_content
         assert "segment" in br_content # Check for segment files listed
 
         # Check for actual segment files
-        segment_dir = track_media_path / br
-        ts_files = list(segment_dir.glob("segment*.ts"))
-        assert len(ts_files) > 0, f"No .ts segment files found in {segment_dir}"
-        for ts_file in ts_files:
-            assert ts_file.stat().st_size > 0, f"Segment file {ts_file} is empty"
+        assert segment_sizes, f"No .ts segment files found in {bitrate_dirs[br]}"
+        for name, size in segment_sizes.items():
+            assert size > 0, f"Segment file {name} in {bitrate_dirs[br]} is empty"
 
     # Verify Track record in DB
-    db = TestSessionLocal()
-    try:
-        track_from_db = db.query(Track).filter(Track.id == track_id).first()
-        assert track_from_db is not None
-        assert track_from_db.status == "ready"
-        assert track_from_db.hls_root == str(master_m3u8_path)
-        assert track_from_db.title == "Pipeline Test Track"
-        assert track_from_db.uploader == "testuser" # From authenticated_client fixture
-        assert (Path("/uploads") / track_uuid / "original.mp3").exists() # Check original file
-        assert (Path("/uploads") / track_uuid / "cover.jpg").exists() # Check cover file
-    finally:
-        db.close()
+    track_from_db = db_session.get(Track, track_id)
+    assert track_from_db is not None
+    assert track_from_db.status == "ready"
+    assert track_from_db.hls_root == str(master_m3u8_path)
+    assert track_from_db.title == "Pipeline Test Track"
+    assert track_from_db.uploader == "testuser" # From authenticated_client fixture
+    assert (Path("/uploads") / track_uuid / "original.mp3").exists() # Check original file
+    assert (Path("/uploads") / track_uuid / "cover.jpg").exists() # Check cover file
@@ -0,0 +1,339 @@
+import asyncio
+import json
+import time
+
+import pytest
+from backend import ws
+from backend.auth import User
+from backend.ws import (
+    SEND_QUEUE_LIMIT,
+    SEND_QUEUE_MAX_BYTES,
+    ConnectionManager,
+    _Outbox,
+)
+
+
+async def settle():
+    """Runs the event loop until the outbox writer tasks have sent what is queued."""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class RecordingWebSocket:
+    """Accepts the connection and keeps every frame sent to it."""
+
+    def __init__(self):
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send(self, message):
+        self.sent.append(message["bytes"])
+
+    async def close(self, code=1000, reason=None):
+        self.close_code = code
+
+    def messages(self):
+        """Sent frames parsed, with batch envelopes unpacked."""
+        parsed = [json.loads(frame) for frame in self.sent]
+        return [
+            m for p in parsed for m in (p["frames"] if p["type"] == "batch" else [p])
+        ]
+
+
+class StalledWebSocket:
+    """Accepts the connection, then never finishes a send (a client that stopped
+    reading)."""
+
+    def __init__(self):
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send(self, message):
+        await asyncio.Event().wait()
+
+    async def close(self, code=1000, reason=None):
+        self.close_code = code
+
+
+def frame(data: bytes) -> dict:
+    return {"type": "websocket.send", "bytes": data}
+
+
+@pytest.fixture
+def manager():
+    manager = ConnectionManager()
+    yield manager
+    # Stop the writer tasks of sockets a test left open
+    for outbox in manager._outbox_list:
+        outbox.close()
+
+
+async def connect(manager: ConnectionManager, username: str, websocket=None):
+    websocket = websocket or RecordingWebSocket()
+    await manager.connect(websocket, User(username=username, is_admin=False))
+    return websocket
+
+
+async def test_frames_queued_together_go_out_as_one_batch(manager):
+    websocket = await connect(manager, "batcher")
+    # Queued in the same event-loop turn as the connect snapshot, before the writer runs
+    await manager._broadcast(b'{"type":"a"}')
+    await manager._broadcast(b'{"type":"b"}')
+    await settle()
+
+    assert websocket.sent == [
+        b'{"type":"batch","frames":['
+        b'{"type":"presence","users":[{"username":"batcher","track_id":null,"online":true}]},'
+        b'{"type":"a"},{"type":"b"}]}'
+    ]
+
+    # A lone frame is sent as is
+    await manager._broadcast(b'{"type":"c"}')
+    await settle()
+    assert websocket.sent[-1] == b'{"type":"c"}'
+
+
+async def test_presence_broadcasts_full_list_then_deltas(manager):
+    alice = await connect(manager, "alice")
+    await connect(manager, "bob")
+    await connect(manager, "carol")
+    await manager.broadcast_presence()  # Every row changed: the full list
+    await settle()
+    assert alice.messages()[-1] == {
+        "type": "presence",
+        "users": [
+            {"username": "alice", "track_id": None, "online": True},
+            {"username": "bob", "track_id": None, "online": True},
+            {"username": "carol", "track_id": None, "online": True},
+        ],
+    }
+
+    manager.set_track_presence("bob", "42")
+    await manager.broadcast_presence()
+    await settle()
+    assert alice.messages()[-1] == {
+        "type": "presence_delta",
+        "updated": [{"username": "bob", "track_id": "42", "online": True}],
+        "removed": [],
+    }
+
+    # Offline without a track: the row is removed
+    manager.disconnect_by_username("carol")
+    await manager.broadcast_presence()
+    await settle()
+    assert alice.messages()[-1] == {
+        "type": "presence_delta",
+        "updated": [],
+        "removed": ["carol"],
+    }
+
+    # Changes that cancel out before the broadcast send nothing
+    sent = len(alice.sent)
+    manager.set_track_presence("bob", None)
+    manager.set_track_presence("bob", "42")
+    await manager.broadcast_presence()
+    await settle()
+    assert len(alice.sent) == sent
+
+
+async def test_full_queue_replaces_presence_frames_with_one_snapshot():
+    failures = []
+    snapshot = frame(b'{"type":"presence","users":[]}')
+    outbox = _Outbox(
+        "resync",
+        StalledWebSocket(),
+        lambda *args: failures.append(args),
+        lambda: snapshot,
+    )
+    outbox.put(frame(b'{"type":"first"}'))
+    # The writer takes it and stalls, so everything below stays queued
+    await asyncio.sleep(0)
+
+    outbox.put(
+        frame(b'{"type":"presence_delta","updated":[],"removed":["x"]}'), presence=True
+    )
+    outbox.put(
+        frame(b'{"type":"presence_delta","updated":[],"removed":["y"]}'), presence=True
+    )
+    chats = [frame(b'{"type":"chat","n":%d}' % i) for i in range(SEND_QUEUE_LIMIT - 2)]
+    for chat in chats:
+        outbox.put(chat)
+    overflow = frame(b'{"type":"chat","n":"overflow"}')
+    outbox.put(overflow)
+
+    # The deltas collapsed into one snapshot, which made room for the new frame
+    assert failures == []
+    assert list(outbox._pending) == [(chat, False) for chat in chats] + [
+        (snapshot, True),
+        (overflow, False),
+    ]
+    assert outbox._pending_bytes == sum(
+        len(message["bytes"]) for message, _ in outbox._pending
+    )
+
+    # A presence frame put on a full queue is itself replaced by the snapshot
+    outbox.put(
+        frame(b'{"type":"presence_delta","updated":[],"removed":["z"]}'), presence=True
+    )
+    assert failures == []
+    assert list(outbox._pending) == [(chat, False) for chat in chats] + [
+        (overflow, False),
+        (snapshot, True),
+    ]
+
+    # Full again with nothing left to collapse: the client is dropped
+    outbox.put(frame(b'{"type":"chat","n":"too many"}'))
+    assert failures == [("resync", outbox.websocket)]
+    outbox.close()
+
+
+async def test_direct_message_frames_are_exact_json(manager):
+    alice = await connect(manager, "alice")
+    bob = await connect(manager, "bob")
+    await settle()
+    alice.sent.clear()
+    bob.sent.clear()
+
+    content = 'say "hi" ✓'
+    await manager.send_direct_message(
+        "alice", "bob", content, "2026-10-15T12:00:00.000000Z", 7
+    )
+    await settle()
+
+    payload = {
+        "id": 7,
+        "sender": "alice",
+        "content": content,
+        "timestamp": "2026-10-15T12:00:00.000000Z",
+        "target": "bob",
+    }
+    assert bob.sent == [
+        ws._dumps({"type": "dm", "payload": {**payload, "from_user": "alice"}})
+    ]
+    assert alice.sent == [ws._dumps({"type": "dm_receipt", "payload": payload})]
+    assert bob.sent[0] == (
+        '{"type":"dm","payload":{"id":7,"sender":"alice",'
+        '"content":"say \\"hi\\" ✓","timestamp":"2026-10-15T12:00:00.000000Z",'
+        '"target":"bob","from_user":"alice"}}'
+    ).encode()
+
+
+async def test_chat_writer_resolves_each_sender_with_its_own_row(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    batches = []
+
+    def fake_persist(rows):
+        batches.append(rows)
+        return [(100 + i, f"ts-{content}") for i, (_, content, _) in enumerate(rows)]
+
+    monkeypatch.setattr(ws, "_persist_chats", fake_persist)
+    writer = asyncio.create_task(ws.chat_writer_task())
+    await asyncio.sleep(0)
+    try:
+        contents = [f"message {i}" for i in range(5)]
+        results = await asyncio.gather(
+            *(ws.persist_chat("alice", content, None) for content in contents)
+        )
+    finally:
+        writer.cancel()
+        await asyncio.gather(writer, return_exceptions=True)
+
+    # One commit for all five
+    assert batches == [[("alice", content, None) for content in contents]]
+    assert results == [(100 + i, f"ts-{content}") for i, content in enumerate(contents)]
+    assert ws._chat_write_queue is None
+
+
+async def test_chat_writer_fails_every_sender_in_a_failed_batch(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    def failing_persist(rows):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(ws, "_persist_chats", failing_persist)
+    writer = asyncio.create_task(ws.chat_writer_task())
+    await asyncio.sleep(0)
+    try:
+        results = await asyncio.gather(
+            ws.persist_chat("alice", "one", None),
+            ws.persist_chat("bob", "two", "alice"),
+            return_exceptions=True,
+        )
+    finally:
+        writer.cancel()
+        await asyncio.gather(writer, return_exceptions=True)
+
+    assert [type(result) for result in results] == [RuntimeError, RuntimeError]
+
+
+async def test_reconnect_survives_the_old_handlers_late_disconnect(manager):
+    old = await connect(manager, "flaky")
+    manager.set_track_presence("flaky", "7")
+    new = await connect(manager, "flaky")
+    await settle()
+
+    # The old socket's endpoint exits after the new one connected; only its socket goes
+    assert manager.disconnect_by_username("flaky", old) is True
+    assert manager.disconnect_by_username("flaky", old) is False
+    assert [outbox.websocket for outbox in manager._outbox_list] == [new]
+    assert manager._presence_snapshot["flaky"] == {
+        "username": "flaky",
+        "track_id": "7",
+        "online": True,
+    }
+    assert new.messages()[0] == {
+        "type": "presence",
+        "users": [{"username": "flaky", "track_id": "7", "online": True}],
+    }
+
+
+async def test_client_over_byte_budget_is_dropped_and_closed(manager):
+    websocket = await connect(manager, "slowpoke", StalledWebSocket())
+    await asyncio.sleep(0)  # The writer takes the connect snapshot and stalls on it
+
+    big = b'"' + b"x" * (SEND_QUEUE_MAX_BYTES // 4) + b'"'
+    for _ in range(5):  # The fifth frame no longer fits in the byte budget
+        await manager._broadcast(big)
+    await asyncio.sleep(0)  # Let the scheduled close run
+
+    assert websocket.close_code == 1013
+    assert manager._outbox_list == []
+    assert "slowpoke" not in manager.users
+
+
+async def test_second_socket_for_same_user_keeps_the_first_open(manager):
+    first = await connect(manager, "twotabs")
+    second = await connect(manager, "twotabs")
+    await asyncio.sleep(0)
+
+    await manager._broadcast(b'{"type":"ping"}')
+    await settle()
+    assert first.close_code is None and second.close_code is None
+    assert {"type": "ping"} in first.messages()
+    assert {"type": "ping"} in second.messages()
+
+    # Closing one tab leaves the user online on the other
+    manager.disconnect_by_username("twotabs", first)
+    assert manager._presence_snapshot["twotabs"]["online"] is True
+    assert [outbox.websocket for outbox in manager._outbox_list] == [second]
+
+    manager.disconnect_by_username("twotabs", second)
+    assert manager._presence_snapshot == {}
+    assert manager._outbox_list == []
+
+
+async def test_idle_offline_presence_is_evicted(manager):
+    manager.set_track_presence("gone", "9")
+    manager.set_track_presence("recent", "10")
+    manager.users["gone"].last_seen = time.monotonic() - 100
+
+    manager.evict_idle_presence(max_idle=50)
+
+    assert "gone" not in manager.users and "gone" not in manager._presence_snapshot
+    assert manager._presence_snapshot["recent"]["track_id"] == "10"
@@ -1,10 +1,128 @@
+import asyncio
 import subprocess
-import os
+import tempfile
 from pathlib import Path
 
+# Pre-encoded 1 kHz, 1-second sine MP3 checked in with the tests; the duration every
+# upload test uses, so those never need FFmpeg.
+SINE_1S_MP3 = Path(__file__).parent / "data" / "sine_1s.mp3"
+
+# Encoded sine-wave MP3 bytes per duration; the output is deterministic, so it is reused
+# for the whole test process.
+_SINE_MP3_CACHE: dict[int, bytes] = {1: SINE_1S_MP3.read_bytes()}
+
+def _sine_mp3_command(outputs: dict[int, Path]) -> list[str]:
+    """FFmpeg command encoding a 1 kHz sine: one lavfi input, one `-t <duration>` output per entry."""
+    command = [
+        "ffmpeg",
+        "-y", # Overwrite output files if they exist
+        "-f", "lavfi",
+        "-i", f"sine=frequency=1000:duration={max(outputs)}",
+    ]
+    for duration, output_path in outputs.items():
+        # Cheapest MP3 encode: lowest VBR quality, mono, 22.05 kHz; the upload pipeline re-encodes anyway
+        command += ["-t", str(duration), "-c:a", "libmp3lame", "-q:a", "9", "-ac", "1", "-ar", "22050", str(output_path)]
+    return command
+
+def _check_ffmpeg_result(command: list[str], returncode: int, stdout: str, stderr: str) -> None:
+    """
+    Raises:
+        RuntimeError: If FFmpeg exited with a non-zero code.
+    """
+    if returncode != 0:
+        error_message = f"FFmpeg command failed with exit code {returncode}.\n"
+        error_message += f"Command: {' '.join(command)}\n"
+        error_message += f"Stdout: {stdout}\n"
+        error_message += f"Stderr: {stderr}"
+        raise RuntimeError(error_message)
+    print(f"FFmpeg stdout: {stdout}")
+    if stderr:
+        print(f"FFmpeg stderr: {stderr}")
+
+def _read_sine_mp3s(outputs: dict[int, Path]) -> dict[int, bytes]:
+    """
+    Raises:
+        RuntimeError: If an output is missing or empty.
+    """
+    encoded = {}
+    for duration, output_path in outputs.items():
+        if not output_path.exists() or output_path.stat().st_size == 0:
+            raise RuntimeError(f"Generated MP3 file {output_path} not found or is empty.")
+        encoded[duration] = output_path.read_bytes()
+    return encoded
+
+def _encode_sine_mp3s(durations: list[int]) -> dict[int, bytes]:
+    """
+    Encodes a 1 kHz sine wave to MP3 once per duration, with a single FFmpeg process.
+
+    Raises:
+        RuntimeError: If FFmpeg command fails or an output is missing or empty.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        outputs = {d: Path(tmp_dir) / f"sine_{d}.mp3" for d in durations}
+        command = _sine_mp3_command(outputs)
+        process = subprocess.run(command, capture_output=True, text=True)
+        _check_ffmpeg_result(command, process.returncode, process.stdout, process.stderr)
+        return _read_sine_mp3s(outputs)
+
+async def _encode_sine_mp3s_async(durations: list[int]) -> dict[int, bytes]:
+    """Like _encode_sine_mp3s, but awaits FFmpeg instead of blocking the event loop."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        outputs = {d: Path(tmp_dir) / f"sine_{d}.mp3" for d in durations}
+        command = _sine_mp3_command(outputs)
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+        _check_ffmpeg_result(command, process.returncode, stdout.decode(), stderr.decode())
+        return _read_sine_mp3s(outputs)
+
+def _write_sine_mp3s(specs: list[tuple[Path, int]]) -> list[Path]:
+    for output_path, duration in specs:
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_path.write_bytes(_SINE_MP3_CACHE[duration])
+    return [output_path for output_path, _ in specs]
+
+def _missing_durations(specs: list[tuple[Path, int]]) -> list[int]:
+    return sorted({duration for _, duration in specs} - _SINE_MP3_CACHE.keys())
+
+def generate_test_mp3s(specs: list[tuple[Path, int]]) -> list[Path]:
+    """
+    Writes several sine-wave test MP3 files. 1-second files come from the checked-in
+    fixture; FFmpeg runs at most once for all other durations not encoded yet.
+
+    Args:
+        specs: (output_path, duration_seconds) pairs.
+
+    Returns:
+        The output paths, in the order given.
+
+    Raises:
+        RuntimeError: If FFmpeg command fails.
+    """
+    missing = _missing_durations(specs)
+    if missing:
+        _SINE_MP3_CACHE.update(_encode_sine_mp3s(missing))
+    return _write_sine_mp3s(specs)
+
+async def generate_test_mp3s_async(specs: list[tuple[Path, int]]) -> list[Path]:
+    """
+    Async variant of generate_test_mp3s for async tests and fixtures: FFmpeg runs via
+    asyncio.create_subprocess_exec, so the event loop keeps serving other work meanwhile.
+
+    Raises:
+        RuntimeError: If FFmpeg command fails.
+    """
+    missing = _missing_durations(specs)
+    if missing:
+        _SINE_MP3_CACHE.update(await _encode_sine_mp3s_async(missing))
+    return _write_sine_mp3s(specs)
+
 def generate_test_mp3(output_dir: Path, filename: str = "test_sine.mp3", duration_seconds: int = 2) -> Path:
     """
-    Generates a test MP3 file with a sine wave using FFmpeg.
+    Writes a test MP3 file with a sine wave; see generate_test_mp3s.
 
     Args:
         output_dir: The directory where the MP3 file will be saved.
@@ -17,30 +135,14 @@ def generate_test_mp3(output_dir: Path, filename: str = "test_sine.mp3", duratio
     Raises:
         RuntimeError: If FFmpeg command fails.
     """
-    output_dir.mkdir(parents=True, exist_ok=True)
-    output_path = output_dir / filename
+    return generate_test_mp3s([(output_dir / filename, duration_seconds)])[0]
 
-    command = [
-        "ffmpeg",
-        "-f", "lavfi",
-        "-i", f"sine=frequency=1000:duration={duration_seconds}",
-        "-y", # Overwrite output file if it exists
-        str(output_path)
-    ]
+def create_test_session_for_app(username: str = "testuser") -> str:
+    """
+    Creates a session token using the app's global session manager.
 
-    try:
-        process = subprocess.run(command, capture_output=True, text=True, check=True)
-        print(f"FFmpeg stdout: {process.stdout}")
-        if process.stderr:
-            print(f"FFmpeg stderr: {process.stderr}")
-    except subprocess.CalledProcessError as e:
-        error_message = f"FFmpeg command failed with exit code {e.returncode}.\n"
-        error_message += f"Command: {' '.join(e.cmd)}\n"
-        error_message += f"Stdout: {e.stdout}\n"
-        error_message += f"Stderr: {e.stderr}"
-        raise RuntimeError(error_message) from e
-
-    if not output_path.exists() or output_path.stat().st_size == 0:
-        raise RuntimeError(f"Generated MP3 file {output_path} not found or is empty.")
-
-    return output_path
+    get_current_user validates cookies against that same manager, so tokens minted
+    here are accepted by the API under test.
+    """
+    from backend.auth import session_manager as app_session_manager
+    return app_session_manager.create_session(username)
@@ -1,5 +1,6 @@
 import datetime
-from sqlalchemy import create_engine, Column, Integer, String, JSON, DateTime, ForeignKey, Boolean, Text
+import uuid
+from sqlalchemy import create_engine, Column, Integer, String, JSON, DateTime, ForeignKey, Boolean, Text, Index
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.sql import func
 
@@ -11,13 +12,11 @@ class UserPreference(Base):
     theme = Column(String, default="system")
     muted_uploaders = Column(JSON, default=[])
 
-import uuid # Add this import
-
 class Track(Base):
     __tablename__ = "tracks"
     id = Column(Integer, primary_key=True, autoincrement=True)
     # Add a UUID field for unique identification in file paths
-    uuid = Column(String, default=lambda: str(uuid.uuid4()), unique=True, nullable=False)
+    uuid = Column(String(36), default=lambda: str(uuid.uuid4()), unique=True, nullable=False)
     title = Column(String, nullable=False)
     uploader = Column(String, nullable=False) # Should this be a ForeignKey to a User table? For now, String.
     original_path = Column(String, nullable=True) # Path to the original uploaded file, explicitly nullable
@@ -27,6 +26,11 @@ class Track(Base):
     duration = Column(Integer, nullable=True) # Duration in seconds
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        Index("ix_tracks_uploader_status", "uploader", "status"), # Uploader listings by status
+        Index("ix_tracks_status_created", "status", "created_at"), # Ready-track listings
+    )
+
 class Playlist(Base):
     __tablename__ = "playlists"
     id = Column(Integer, primary_key=True, autoincrement=True) # Changed to autoincrement as per common practice
@@ -44,13 +48,23 @@ class PlaylistTrack(Base):
     playlist = relationship("Playlist", back_populates="tracks")
     track = relationship("Track") # No back_populates needed if Track doesn't need to know about Playlists
 
+    __table_args__ = (
+        Index("ix_pt_playlist_position", "playlist_id", "position"), # Ordered tracks of a playlist
+    )
+
 class Chat(Base):
     __tablename__ = "chats"
     id = Column(Integer, primary_key=True, autoincrement=True)
     sender = Column(String, nullable=False) # ForeignKey to User?
     target = Column(String, nullable=True) # ForeignKey to User? Nullable for group/system messages?
     content = Column(Text, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Set in Python so the inserted object already holds an aware UTC timestamp; the server
+    # default still covers rows inserted outside the ORM
+    created_at = Column(
+        DateTime(timezone=True),
+        default=lambda: datetime.datetime.now(datetime.timezone.utc),
+        server_default=func.now(),
+    )
 
 class RemovalRequest(Base):
     __tablename__ = "removal_requests"
@@ -1,97 +1,311 @@
 import asyncio
 import json
-from typing import Set, Dict, Any, Optional, List # Added Optional, List
-from fastapi import APIRouter, WebSocket, Depends, WebSocketDisconnect, HTTPException, status
-from backend.auth import get_current_user, User # Assuming User model is appropriate
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Set, Dict, Any, Optional, List, Callable, Deque # Added Optional, List
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+from loguru import logger # Debug-level messages are dropped before formatting at the default INFO level
+from backend.auth import _resolve_user_from_cookies, User # Assuming User model is appropriate
+
+# Outgoing frames are UTF-8 JSON bytes, encoded once per message and sent as binary frames.
+# orjson encodes and parses several times faster than the json module; when it is absent,
+# fall back to one reusable compact encoder (same output as orjson: no spaces, raw UTF-8).
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers catch the latter.
+try:
+    import orjson
+
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    _encode_json = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+    _loads = json.loads
+
+    def _dumps(message: Any) -> bytes:
+        return _encode_json(message).encode()
 
 router = APIRouter()
 
+SEND_TIMEOUT = 5  # seconds; a client that can't take a frame in time is dropped
+SEND_QUEUE_LIMIT = 256  # frames waiting per connection before it counts as too slow
+SEND_QUEUE_MAX_BYTES = 1 << 20  # bytes waiting per connection, so a stalled client's backlog stays bounded
+
+# Close tasks scheduled from synchronous code; referenced here so they are not garbage collected
+_closing_tasks: Set[asyncio.Task] = set()
+
+async def _close_quietly(websocket: WebSocket, code: int, reason: str):
+    try:
+        await websocket.close(code=code, reason=reason)
+    except Exception as e: # Already closed by the client, or the transport is gone
+        logger.debug("Closing WebSocket failed: {!r}", e)
+
+def _schedule_close(websocket: WebSocket, code: int, reason: str):
+    """Closes a socket from synchronous code; its endpoint then sees the disconnect and exits."""
+    task = asyncio.get_running_loop().create_task(_close_quietly(websocket, code, reason))
+    _closing_tasks.add(task)
+    task.add_done_callback(_closing_tasks.discard)
+
+class _Outbox:
+    """
+    Per-connection send queue drained by one writer task. Frames queued while the previous
+    write is in flight (or within the same event-loop turn) go out together in one write,
+    as a {"type": "batch", "frames": [...]} envelope.
+    """
+    def __init__(
+        self,
+        username: str,
+        websocket: WebSocket,
+        on_failure: Callable[[str, WebSocket], None],
+        presence_snapshot: Callable[[], Dict[str, Any]],
+    ):
+        self.username = username
+        self.websocket = websocket
+        self._on_failure = on_failure
+        self._presence_snapshot = presence_snapshot # Full presence message, for resyncing after drops
+        self._pending: Deque[tuple[Dict[str, Any], bool]] = deque() # (ASGI message, is presence)
+        self._pending_bytes = 0
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._flush_loop())
+        self.index = -1 # Position in ConnectionManager._outbox_list while registered
+
+    def _is_full(self, size: int) -> bool:
+        return len(self._pending) >= SEND_QUEUE_LIMIT or self._pending_bytes + size > SEND_QUEUE_MAX_BYTES
+
+    def _append(self, message: Dict[str, Any], presence: bool):
+        self._pending.append((message, presence))
+        self._pending_bytes += len(message["bytes"])
+
+    def put(self, message: Dict[str, Any], presence: bool = False):
+        if self._is_full(len(message["bytes"])):
+            message = self._make_room(message, presence)
+            if message is None:
+                return
+        self._append(message, presence)
+        self._wakeup.set()
+
+    def _make_room(self, message: Dict[str, Any], presence: bool) -> Optional[Dict[str, Any]]:
+        """put() on a full queue: returns the message to queue, or None if the client was dropped."""
+        if any(is_presence for _, is_presence in self._pending):
+            # Presence frames may be deltas, so none can be dropped alone: replace all of them
+            # with one full snapshot, which already reflects a presence frame being put now
+            kept = [queued for queued, is_presence in self._pending if not is_presence]
+            self._pending.clear()
+            self._pending_bytes = 0
+            for queued in kept:
+                self._append(queued, False)
+            snapshot = self._presence_snapshot()
+            if presence:
+                message = snapshot
+            else:
+                self._append(snapshot, True)
+            if not self._is_full(len(message["bytes"])):
+                return message
+        logger.warning("Send queue full for {}, dropping the connection", self.username)
+        self._on_failure(self.username, self.websocket)
+        return None
+
+    def close(self):
+        self._task.cancel()
+
+    async def _flush_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                if len(self._pending) == 1:
+                    message = self._pending.popleft()[0]
+                else:
+                    # Frames are already JSON, so the envelope is plain concatenation
+                    frames = b",".join(message["bytes"] for message, _ in self._pending)
+                    self._pending.clear()
+                    message = {"type": "websocket.send", "bytes": b'{"type":"batch","frames":[' + frames + b"]}"}
+                self._pending_bytes = 0 # Everything pending was just taken
+                try:
+                    await asyncio.wait_for(self.websocket.send(message), timeout=SEND_TIMEOUT)
+                except Exception as e:
+                    logger.warning("Error sending message to {}: {!r}", self.username, e)
+                    self._on_failure(self.username, self.websocket)
+                    return
+
+@dataclass(slots=True)
+class _UserState:
+    """Everything the manager tracks for one username, so each event needs a single lookup."""
+    # One per open socket (several tabs, or Layout plus AdminPage); empty while the user is offline
+    outboxes: List[_Outbox] = field(default_factory=list)
+    track_id: Optional[str] = None
+    last_seen: float = 0.0 # time.monotonic() of the last disconnect or track update
+
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-        self.user_presences: Dict[str, Dict[str, Any]] = {} # {username: {"track_id": "..."}}
+        # Presence data outlives the connection, so offline users keep their entry
+        self.users: Dict[str, _UserState] = {}
+        # Every open socket's outbox as an array for the broadcast fanout; each outbox's
+        # index field makes removal an O(1) swap with the last slot
+        self._outbox_list: List[_Outbox] = []
+        # Rows of the presence list, kept in sync on connect/disconnect/track updates so
+        # nothing is rebuilt per tick. New sockets get the full list; after that, broadcasts
+        # only carry the rows that changed since the last one (see broadcast_presence).
+        self._presence_snapshot: Dict[str, Dict[str, Any]] = {} # {username: row}
+        self._presence_changes: Set[str] = set() # Usernames whose row changed since the last broadcast
+        self._sent_presence: Dict[str, Dict[str, Any]] = {} # Rows as of the last broadcast
+        # Wakes presence_updater_task, which coalesces a burst of changes into one broadcast.
+        # Created by the task itself, so it is bound to the loop the task runs on.
+        self._presence_dirty: Optional[asyncio.Event] = None
+
+    def _mark_presence_dirty(self, username: str):
+        self._presence_changes.add(username)
+        if self._presence_dirty is not None:
+            self._presence_dirty.set()
+
+    def _full_presence_message(self) -> Dict[str, Any]:
+        """The whole presence list as a ready-to-send ASGI message."""
+        message = {"type": "presence", "users": list(self._presence_snapshot.values())}
+        return {"type": "websocket.send", "bytes": _dumps(message)}
+
+    def _refresh_presence_row(self, username: str, state: _UserState):
+        """Recomputes one user's presence row and marks the snapshot dirty if it changed."""
+        online = bool(state.outboxes)
+        # Only include users who are currently connected or have presence data
+        if online or state.track_id is not None:
+            # Rows carry only track_id; the frontend (Layout) fetches track details itself
+            row = {"username": username, "track_id": state.track_id, "online": online}
+            if self._presence_snapshot.get(username) != row:
+                self._presence_snapshot[username] = row
+                self._mark_presence_dirty(username)
+        else:
+            # Offline with nothing to show: forget the user entirely
+            del self.users[username]
+            if self._presence_snapshot.pop(username, None) is not None:
+                self._mark_presence_dirty(username)
 
     async def connect(self, websocket: WebSocket, user: User):
         await websocket.accept()
-        self.active_connections[user.username] = websocket
-        # Initialize presence for the user
-        if user.username not in self.user_presences:
-            self.user_presences[user.username] = {"track_id": None}
-        print(f"User {user.username} connected. Total connections: {len(self.active_connections)}")
+        state = self.users.get(user.username)
+        if state is None:
+            state = self.users[user.username] = _UserState()
+        # A user may hold several sockets at once; each gets its own outbox and all receive their frames
+        outbox = _Outbox(user.username, websocket, self._drop_slow_client, self._full_presence_message)
+        outbox.index = len(self._outbox_list)
+        self._outbox_list.append(outbox)
+        state.outboxes.append(outbox)
+        self._refresh_presence_row(user.username, state)
+        # Give the new socket the current view; deltas broadcast after it apply on top
+        outbox.put(self._full_presence_message(), presence=True)
+        logger.debug("User {} connected. Total connections: {}", user.username, len(self._outbox_list))
 
     def disconnect(self, user: User):
-        if user.username in self.active_connections:
-            del self.active_connections[user.username]
-        # Optionally, remove from user_presences or mark as offline
-        # For now, presence data persists until overwritten or explicitly cleared
-        print(f"User {user.username} disconnected. Total connections: {len(self.active_connections)}")
-
-    async def _broadcast(self, message_json: str, target_users: Optional[List[str]] = None):
-        """Helper to broadcast a JSON message to all or specific connected users."""
-        if not self.active_connections:
+        self.disconnect_by_username(user.username)
+
+    def disconnect_by_username(self, username: str, websocket: Optional[WebSocket] = None) -> bool:
+        """Drops all of the user's connections, or with `websocket` only that one; returns whether any was open."""
+        state = self.users.get(username)
+        if state is None:
+            return False
+        dropped = [outbox for outbox in state.outboxes if websocket is None or outbox.websocket is websocket]
+        if not dropped:
+            return False
+        for outbox in dropped:
+            state.outboxes.remove(outbox)
+            # Swap-remove: move the last slot into the freed one
+            last = self._outbox_list.pop()
+            if last is not outbox:
+                self._outbox_list[outbox.index] = last
+                last.index = outbox.index
+            outbox.index = -1
+            outbox.close()
+        if not state.outboxes:
+            state.last_seen = time.monotonic()
+            # Presence data (track_id) persists until overwritten, cleared or evicted as idle
+            self._refresh_presence_row(username, state)
+        logger.debug("User {} disconnected. Total connections: {}", username, len(self._outbox_list))
+        return True
+
+    def _drop_slow_client(self, username: str, websocket: WebSocket):
+        """Outbox failure callback: disconnects the socket and closes it, so the endpoint's
+        receive loop ends and the client reconnects instead of lingering unseen."""
+        if not self.disconnect_by_username(username, websocket):
+            return
+        # 1013 (try again later): the frontend reconnects on it, unlike 1008/1011
+        _schedule_close(websocket, status.WS_1013_TRY_AGAIN_LATER, "Too slow to receive messages")
+
+    def set_track_presence(self, username: str, track_id: str | None):
+        state = self.users.get(username)
+        if state is None:
+            state = self.users[username] = _UserState()
+        state.track_id = track_id
+        state.last_seen = time.monotonic()
+        self._refresh_presence_row(username, state)
+
+    def evict_idle_presence(self, max_idle: float):
+        """Drops offline users whose presence has not changed for `max_idle` seconds."""
+        cutoff = time.monotonic() - max_idle
+        idle = [
+            (username, state) for username, state in self.users.items()
+            if not state.outboxes and state.last_seen < cutoff
+        ]
+        for username, state in idle:
+            state.track_id = None
+            self._refresh_presence_row(username, state)
+
+    async def _broadcast(self, frame: bytes, target_users: Optional[List[str]] = None, presence: bool = False):
+        """Helper to queue an encoded JSON frame for all or specific connected users."""
+        if not self._outbox_list:
             return
 
-        tasks = []
+        # One ASGI message shared by every connection, skipping send_bytes' per-call dict.
+        # Safe to share: Starlette and uvicorn's websockets/wsproto protocols only read it.
+        asgi_message = {"type": "websocket.send", "bytes": frame}
         # If target_users is specified, send only to them if they are active
         # Otherwise, send to all active connections
-        users_to_send_to = target_users if target_users is not None else list(self.active_connections.keys())
-
-        active_target_users = []
-        for username in users_to_send_to:
-            if username in self.active_connections:
-                tasks.append(self.active_connections[username].send_text(message_json))
-                active_target_users.append(username)
-
-        if tasks:
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            for i, result in enumerate(results):
-                if isinstance(result, Exception):
-                    failed_username = active_target_users[i] # Assumes results are in order of tasks
-                    print(f"Error broadcasting message to {failed_username}: {result}")
-
-    async def send_personal_message(self, message: str, user: User):
-        if user.username in self.active_connections:
-            await self.active_connections[user.username].send_text(message)
+        if target_users is None:
+            outboxes = list(self._outbox_list) # A full queue may disconnect, which reorders the list
+        else:
+            outboxes = [outbox for state in map(self.users.get, target_users) if state is not None for outbox in state.outboxes]
+        for outbox in outboxes:
+            outbox.put(asgi_message, presence)
+
+    def _send_to(self, username: str, message: Dict[str, Any]) -> bool:
+        """Queues a message on each of one user's sockets; returns whether they are connected."""
+        state = self.users.get(username)
+        if state is None or not state.outboxes:
+            return False
+        for outbox in list(state.outboxes): # A full queue may disconnect, which edits the list
+            outbox.put(message)
+        return True
+
+    async def send_personal_message(self, message: bytes, user: User):
+        """Queues an already encoded JSON frame for one user."""
+        self._send_to(user.username, {"type": "websocket.send", "bytes": message})
 
     async def broadcast_presence(self):
-        if not self.active_connections:
+        # Nothing changed since the last broadcast
+        if not self._presence_changes:
             return
 
-        # Prepare the list of users and their current tracks
-        users_data = []
-        for username, presence_data in self.user_presences.items():
-            # Only include users who are currently connected or have presence data
-            if username in self.active_connections or presence_data.get("track_id") is not None:
-                 # TODO: Fetch track details if needed, for now sending track_id
-                users_data.append({
-                    "username": username,
-                    "track_id": presence_data.get("track_id"),
-                    "online": username in self.active_connections # Add online status
-                })
-
-        # Filter to only include users who are actually online for the broadcast list
-        # Or decide if offline users with last known track should be included.
-        # For now, let's send all users with presence data, marked by "online" status.
-
-        message = {"type": "presence", "users": users_data}
-        message_json = json.dumps(message)
-
-        # Create a list of tasks for sending messages
-        tasks = []
-        active_usernames = list(self.active_connections.keys()) # Cache keys for stable indexing
-        for username in active_usernames:
-            if username in self.active_connections: # Check if still connected
-                tasks.append(self.active_connections[username].send_text(message_json))
-
-        # Execute all send tasks concurrently
-        # results = await asyncio.gather(*tasks, return_exceptions=True)
-        # for i, result in enumerate(results):
-        #     if isinstance(result, Exception):
-        #         # Handle potential errors, e.g., client disconnected abruptly
-        #         failed_username = active_usernames[i]
-        #         print(f"Error sending presence to {failed_username}: {result}")
-        #         # Consider disconnecting this user if send fails repeatedly
-        await self._broadcast(message_json)
+        # Diff the changed rows against what was last broadcast; changes that cancelled
+        # out in the meantime (e.g. a quick reconnect) send nothing
+        updated: List[Dict[str, Any]] = []
+        removed: List[str] = []
+        for username in self._presence_changes:
+            row = self._presence_snapshot.get(username)
+            if row == self._sent_presence.get(username):
+                continue
+            if row is None:
+                removed.append(username)
+                del self._sent_presence[username]
+            else:
+                updated.append(row)
+                self._sent_presence[username] = row
+        self._presence_changes.clear()
+        if not updated and not removed:
+            return
+
+        # A delta as large as the whole list saves nothing, so send the full list instead
+        if len(updated) + len(removed) >= len(self._presence_snapshot):
+            frame = self._full_presence_message()["bytes"]
+        else:
+            frame = _dumps({"type": "presence_delta", "updated": updated, "removed": removed})
+        await self._broadcast(frame, presence=True)
 
 
     async def broadcast_admin_event(self, event_data: Dict[str, Any]):
@@ -107,9 +321,8 @@ class ConnectionManager:
         # to target only actual admin users.
 
         message = {"type": "admin_event", "payload": event_data}
-        message_json = json.dumps(message)
-        print(f"Broadcasting admin event: {message_json}")
-        await self._broadcast(message_json) # Broadcast to all connected clients
+        logger.debug("Broadcasting admin event: {}", event_data)
+        await self._broadcast(_dumps(message)) # Broadcast to all connected clients
 
 
     async def broadcast_chat_message(self, sender: str, content: str, timestamp: str, message_id: int):
@@ -123,7 +336,7 @@ class ConnectionManager:
                 "target": None,
             }
         }
-        await self._broadcast(json.dumps(message))
+        await self._broadcast(_dumps(message))
 
     async def send_direct_message(self, sender: str, recipient: str, content: str, timestamp: str, message_id: int):
         """Sends a direct message to the recipient and a copy to the sender."""
@@ -135,51 +348,32 @@ class ConnectionManager:
             "target": recipient # Indicates this is a DM and who it's for (from sender's perspective)
         }
 
-        # Message for the recipient
-        recipient_message = {
-            "type": "dm", # Specific type for DMs to the recipient
-            "payload": {
-                **message_payload,
-                "from_user": sender # So recipient knows who sent it in the payload directly
-            }
+        # Both frames carry the same payload, so encode it (and the possibly long content) once
+        # and splice it into each envelope. Byte-identical to encoding the two messages:
+        #   recipient: {"type": "dm", "payload": {...message_payload, "from_user": sender}}
+        #   sender:    {"type": "dm_receipt", "payload": message_payload}
+        # The sender's UI can use the 'target' field to place the receipt in the correct DM thread.
+        payload = _dumps(message_payload)
+        recipient_frame = {
+            "type": "websocket.send",
+            "bytes": b'{"type":"dm","payload":' + payload[:-1] + b',"from_user":' + _dumps(sender) + b"}}",
         }
-        recipient_message_json = json.dumps(recipient_message)
+        sender_frame = {"type": "websocket.send", "bytes": b'{"type":"dm_receipt","payload":' + payload + b"}"}
 
-        # Message for the sender (self-receipt)
-        # The sender's UI can use the 'target' field to place this in the correct DM thread
-        sender_receipt_payload = {
-            "id": message_id,
-            "sender": sender, # Message is from current_user
-            "content": content,
-            "timestamp": timestamp,
-            "target": recipient # To know which conversation this message belongs to
-        }
-        sender_message = {
-            "type": "dm_receipt", # Specific type for sender's copy of DM
-            "payload": sender_receipt_payload
-        }
-        sender_message_json = json.dumps(sender_message)
-
-        tasks = []
         # Send to recipient if they are online
-        if recipient in self.active_connections:
-            tasks.append(self.active_connections[recipient].send_text(recipient_message_json))
-            print(f"Attempting to send DM from {sender} to {recipient}")
+        recipient_online = self._send_to(recipient, recipient_frame)
+        if recipient_online:
+            logger.debug("Attempting to send DM from {} to {}", sender, recipient)
         else:
-            print(f"Recipient {recipient} for DM from {sender} is not online.")
+            logger.debug("Recipient {} for DM from {} is not online.", recipient, sender)
 
         # Send to sender if they are online (they should be, as they initiated the message)
-        if sender in self.active_connections:
-            tasks.append(self.active_connections[sender].send_text(sender_message_json))
-            print(f"Attempting to send DM receipt to sender {sender} for message to {recipient}")
-
-        if tasks:
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            for result in results: # Can't easily map back to username here without more complex tracking
-                if isinstance(result, Exception):
-                    print(f"Error sending direct message/receipt: {result}")
-        else:
-            print(f"No active connections to send DM or receipt for message between {sender} and {recipient}")
+        sender_online = self._send_to(sender, sender_frame)
+        if sender_online:
+            logger.debug("Attempting to send DM receipt to sender {} for message to {}", sender, recipient)
+
+        if not recipient_online and not sender_online:
+            logger.debug("No active connections to send DM or receipt for message between {} and {}", sender, recipient)
 
 
 manager = ConnectionManager()
@@ -188,40 +382,101 @@ manager = ConnectionManager()
 from backend.torb.models import Chat
 from sqlalchemy.orm import Session
 from sqlalchemy.sql import func
-import datetime
 
-# This would ideally come from a shared DB session setup, e.g., from main.py or a db_utils.py
-# For simplicity here, let's assume a way to get a DB session.
-# This is a placeholder and needs proper SQLAlchemy session management.
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-DATABASE_URL = "sqlite:///./torb.db" # Make sure this matches your actual DB URL
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Session factory on the app's shared (WAL, pooled) engine
+from backend.routes.preferences import SessionLocal
+from backend.routes.chat import format_chat_timestamp
+
 
+PRESENCE_DEBOUNCE = 0.2  # seconds to gather further changes before broadcasting one
+PRESENCE_MAX_IDLE = 24 * 3600  # seconds an offline user's last track stays in the presence list
+PRESENCE_SWEEP_INTERVAL = 3600  # seconds between sweeps for idle presence entries
 
 async def presence_updater_task():
+    # Event-driven: every presence change wakes it, and new sockets get the full list on
+    # connect. The only timed work is the hourly sweep that keeps offline entries bounded.
+    manager._presence_dirty = presence_dirty = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    next_sweep = loop.time() + PRESENCE_SWEEP_INTERVAL
     while True:
-        await asyncio.sleep(5)
-        print("Broadcasting presence updates...")
+        try:
+            await asyncio.wait_for(presence_dirty.wait(), timeout=max(0.0, next_sweep - loop.time()))
+            await asyncio.sleep(PRESENCE_DEBOUNCE)
+        except asyncio.TimeoutError:
+            pass
+        if loop.time() >= next_sweep:
+            manager.evict_idle_presence(PRESENCE_MAX_IDLE)
+            next_sweep = loop.time() + PRESENCE_SWEEP_INTERVAL
+        presence_dirty.clear()
         await manager.broadcast_presence()
 
+CHAT_BATCH_SIZE = 64  # most chat rows written per commit
+CHAT_BATCH_WINDOW = 0.025  # seconds to gather more messages after the first one
+
+# Queue of (sender, content, target, future) drained by chat_writer_task; None while it is not running
+_chat_write_queue: Optional[asyncio.Queue] = None
+
+def _persist_chats(rows: List[tuple[str, str, Optional[str]]]) -> List[tuple[int, str]]:
+    """Inserts (sender, content, target) chat rows in one commit; returns (id, UTC timestamp) per row."""
+    db: Session = SessionLocal(expire_on_commit=False) # ids come back via RETURNING
+    try:
+        chat_messages = [Chat(sender=sender, content=content, target=target) for sender, content, target in rows]
+        db.add_all(chat_messages)
+        db.commit()
+        # created_at is the aware UTC datetime set by the model's Python-side default
+        return [(chat_message.id, format_chat_timestamp(chat_message.created_at)) for chat_message in chat_messages]
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def persist_chat(sender: str, content: str, target: Optional[str]) -> tuple[int, str]:
+    """Stores a chat message through chat_writer_task (or directly if it is not running)."""
+    if _chat_write_queue is None:
+        return (await asyncio.to_thread(_persist_chats, [(sender, content, target)]))[0]
+    future = asyncio.get_running_loop().create_future()
+    await _chat_write_queue.put((sender, content, target, future))
+    return await future
+
+async def chat_writer_task():
+    """Writes queued chat messages in batches: one commit per CHAT_BATCH_SIZE messages or CHAT_BATCH_WINDOW."""
+    global _chat_write_queue
+    _chat_write_queue = queue = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + CHAT_BATCH_WINDOW
+            while len(batch) < CHAT_BATCH_SIZE:
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout=deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                # Blocking SQLite commit runs in a worker thread so WebSocket sends keep flowing
+                results = await asyncio.to_thread(
+                    _persist_chats, [(sender, content, target) for sender, content, target, _ in batch]
+                )
+                # strict: a short result must fail every sender rather than leave some waiting
+                resolved = list(zip(batch, results, strict=True))
+            except Exception as e:
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (*_, future), result in resolved:
+                if not future.done(): # The sender may have gone away meanwhile
+                    future.set_result(result)
+    finally:
+        _chat_write_queue = None
+
 @router.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    # Attempt to authenticate user from cookie
-    try:
-        # Simulate request object for get_current_user if needed, or adapt get_current_user
-        # FastAPI's WebSocket has `websocket.cookies`
-        class MockRequest:
-            def __init__(self, cookies):
-                self.cookies = cookies
-
-        mock_request = MockRequest(websocket.cookies)
-        current_user: User = await get_current_user(mock_request) # type: ignore
-        if not current_user: # Should not happen if get_current_user raises HTTPException
-            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
-            return
-    except HTTPException: # Handles cases where get_current_user raises 401
+    # Authenticate from the session cookie sent with the handshake
+    current_user = _resolve_user_from_cookies(websocket.cookies)
+    if current_user is None:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Authentication failed")
         return
 
@@ -235,37 +490,26 @@ async def websocket_endpoint(websocket: WebSocket):
             # Example: client could send pings, server sends pongs
             # if data == "ping":
             # await websocket.send_text("pong")
-            print(f"Received message from {current_user.username}: {data}")
+            logger.debug("Received message from {}: {}", current_user.username, data)
 
             try:
-                message_data = json.loads(data)
+                message_data = _loads(data)
                 message_type = message_data.get("type")
                 content = message_data.get("content")
 
                 if not content:
-                    print(f"Received message type '{message_type}' with no content from {current_user.username}")
+                    logger.debug("Received message type '{}' with no content from {}", message_type, current_user.username)
                     continue
 
-                db: Session = SessionLocal()
                 try:
-                    timestamp_iso = None
-                    chat_message_id = None
-
                     if message_type == "chat": # Global chat
-                        chat_message = Chat(
-                            sender=current_user.username,
-                            content=content,
-                            target=None, # For global chat
+                        chat_message_id, timestamp_iso = await persist_chat(
+                            current_user.username, content, None # No target for global chat
                         )
-                        db.add(chat_message)
-                        db.commit()
-                        db.refresh(chat_message)
-                        timestamp_iso = chat_message.created_at.replace(tzinfo=datetime.timezone.utc).isoformat()
-                        chat_message_id = chat_message.id
 
                         await manager.broadcast_chat_message(
-                            sender=chat_message.sender,
-                            content=chat_message.content,
+                            sender=current_user.username,
+                            content=content,
                             timestamp=timestamp_iso,
                             message_id=chat_message_id
                         )
@@ -273,14 +517,14 @@ async def websocket_endpoint(websocket: WebSocket):
                     elif message_type == "dm":
                         recipient = message_data.get("to")
                         if not recipient:
-                            print(f"Received DM from {current_user.username} without recipient.")
+                            logger.debug("Received DM from {} without recipient.", current_user.username)
                             continue
 
                         if recipient == current_user.username:
-                            print(f"User {current_user.username} tried to send DM to themselves.")
+                            logger.debug("User {} tried to send DM to themselves.", current_user.username)
                             # Optionally send an error message back to the user
                             await manager.send_personal_message(
-                                json.dumps({
+                                _dumps({
                                     "type": "error",
                                     "payload": {"message": "Cannot send direct message to yourself."}
                                 }),
@@ -288,48 +532,37 @@ async def websocket_endpoint(websocket: WebSocket):
                             )
                             continue
 
-                        chat_message = Chat(
-                            sender=current_user.username,
-                            content=content,
-                            target=recipient, # For DMs, target is the recipient
+                        chat_message_id, timestamp_iso = await persist_chat(
+                            current_user.username, content, recipient # For DMs, target is the recipient
                         )
-                        db.add(chat_message)
-                        db.commit()
-                        db.refresh(chat_message)
-                        timestamp_iso = chat_message.created_at.replace(tzinfo=datetime.timezone.utc).isoformat()
-                        chat_message_id = chat_message.id
 
                         await manager.send_direct_message(
-                            sender=chat_message.sender,
+                            sender=current_user.username,
                             recipient=recipient,
-                            content=chat_message.content,
+                            content=content,
                             timestamp=timestamp_iso,
                             message_id=chat_message_id
                         )
 
                     else:
-                        print(f"Received unknown message type '{message_type}' from {current_user.username}")
+                        logger.warning("Received unknown message type '{}' from {}", message_type, current_user.username)
 
                 except Exception as e:
-                    print(f"Error processing message type '{message_type}' from {current_user.username}: {e}")
-                    db.rollback()
-                finally:
-                    db.close()
+                    logger.error("Error processing message type '{}' from {}: {}", message_type, current_user.username, e)
 
             except json.JSONDecodeError:
-                print(f"Received non-JSON message from {current_user.username}: {data}")
+                logger.warning("Received non-JSON message from {}: {}", current_user.username, data)
             # We could allow clients to push their presence updates via WebSocket too
             # For now, the PUT /api/presence is the primary mechanism for track updates
 
     except WebSocketDisconnect:
-        print(f"WebSocketDisconnect for user {current_user.username}")
+        logger.debug("WebSocketDisconnect for user {}", current_user.username)
     except Exception as e:
-        print(f"Error in WebSocket for {current_user.username}: {e}")
+        logger.error("Error in WebSocket for {}: {}", current_user.username, e)
     finally:
-        manager.disconnect(current_user)
-        # Potentially update presence to offline or remove if desired
-        # manager.user_presences[current_user.username]["online"] = False
-        # await manager.broadcast_presence() # Optionally broadcast after disconnect
+        # Only this handler's socket: the user's other tabs stay connected
+        manager.disconnect_by_username(current_user.username, websocket)
+        # disconnect marks the user offline; presence_updater_task broadcasts the change
 
 # Note: The presence_updater_task needs to be started when the FastAPI application starts.
 # This will be handled in main.py.
@@ -343,14 +576,9 @@ async def update_user_track_presence(username: str, track_id: str | None):
     Updates the track presence for a user.
     This function will be called by the PUT /api/presence endpoint.
     """
-    if username not in manager.user_presences:
-        manager.user_presences[username] = {}
-
-    manager.user_presences[username]["track_id"] = track_id
-    print(f"Updated presence for {username}: track_id = {track_id}")
-    # After updating, immediately broadcast to reflect the change quickly.
-    # This makes the system more responsive than waiting for the next 5s interval.
-    await manager.broadcast_presence()
+    manager.set_track_presence(username, track_id)
+    logger.debug("Updated presence for {}: track_id = {}", username, track_id)
+    # presence_updater_task broadcasts it shortly, coalesced with any other updates
 
 # Example of how a route for PUT /api/presence might look (to be placed in its own file later)
 # from fastapi import Body
@@ -1,6 +1,8 @@
 import { useState, useEffect, useCallback, useRef } from 'react';
 
 const WS_URL = `ws://${window.location.host}/ws`; // Assumes backend is on the same host
+// Every server frame is JSON sent as a binary (UTF-8) frame
+const frameDecoder = new TextDecoder();
 
 interface UserPresence {
   username: string;
@@ -19,6 +21,13 @@ interface PresenceMessage {
   users: UserPresence[];
 }
 
+// Rows changed since the previous presence message; applies on top of the current list
+interface PresenceDeltaMessage {
+  type: 'presence_delta';
+  updated: UserPresence[];
+  removed: string[];
+}
+
 interface ChatMessagePayload {
   id: number;
   sender: string;
@@ -46,7 +55,13 @@ interface ErrorMessage {
   payload: { message: string };
 }
 
-type WebSocketMessage = PresenceMessage | ChatMessage | DirectMessage | DirectMessageReceipt | ErrorMessage;
+type WebSocketMessage = PresenceMessage | PresenceDeltaMessage | ChatMessage | DirectMessage | DirectMessageReceipt | ErrorMessage;
+
+// Several messages queued for this client at once, delivered in one frame
+interface BatchMessage {
+  type: 'batch';
+  frames: WebSocketMessage[];
+}
 
 // Define a structure for storing DMs, keyed by the other user's username
 export interface DirectMessagesState {
@@ -91,6 +106,7 @@ const usePresence = () => {
 
     console.log('Attempting to connect WebSocket...');
     socketRef.current = new WebSocket(WS_URL);
+    socketRef.current.binaryType = 'arraybuffer';
 
     socketRef.current.onopen = () => {
       console.log('WebSocket connected.');
@@ -100,71 +116,81 @@ const usePresence = () => {
       getAllUnreadCounts().then(counts => setUnreadCounts(counts));
     };
 
-    socketRef.current.onmessage = (event) => {
-      try {
-        const message = JSON.parse(event.data as string) as WebSocketMessage; // Use the union type
-
-        if (message.type === 'presence') {
-          const sortedUsers = message.users.sort((a, b) => {
-            if (a.online && !b.online) return -1;
-            if (!a.online && b.online) return 1;
-            return a.username.localeCompare(b.username);
-          });
-          setOnlineUsers(sortedUsers);
-        } else if (message.type === 'chat') { // Global chat message
-          setGlobalChatMessages((prevMessages) => {
-            if (prevMessages.find(m => m.id === message.payload.id)) return prevMessages;
-            const newMessages = [...prevMessages, message.payload];
-            newMessages.sort((a, b) => new Date(a.timestamp).getTime() - new Date(b.timestamp).getTime());
-            return newMessages;
-          });
-        } else if (message.type === 'dm' || message.type === 'dm_receipt') {
-          const dmPayload = message.payload;
-          // Determine the other user involved in the DM
-          // For 'dm', `from_user` is the sender. For 'dm_receipt', `target` is the other user.
-          const otherUser = message.type === 'dm' ? (message.payload as DirectMessage['payload']).from_user : dmPayload.target;
-
-          if (!otherUser) {
-            console.error("DM or receipt does not have a valid other user:", message);
-            return;
-          }
+    const sortPresence = (users: UserPresence[]) => users.sort((a, b) => {
+      if (a.online && !b.online) return -1;
+      if (!a.online && b.online) return 1;
+      return a.username.localeCompare(b.username);
+    });
 
-          setDirectMessages(prevDms => {
-            const userDms = prevDms[otherUser] || [];
-            if (userDms.find(m => m.id === dmPayload.id)) return prevDms; // Avoid duplicates
-            const updatedUserDms = [...userDms, dmPayload];
-            updatedUserDms.sort((a, b) => new Date(a.timestamp).getTime() - new Date(b.timestamp).getTime());
-            return { ...prevDms, [otherUser]: updatedUserDms };
-          });
-
-          // Handle unread counts and notifications for incoming DMs ('dm' type)
-          // Only increment if the message is from another user (not a receipt for self-sent message)
-          // and the chat window for this user is not currently active (this check happens in ChatPage.tsx)
-          if (message.type === 'dm') {
-            const sender = (message.payload as DirectMessage['payload']).from_user;
-            // Check if the current user is the recipient
-            if (dmPayload.target === currentUsernameRef.current) {
-                 // Heuristic: if document is hidden or chat with `sender` is not active, increment unread.
-                 // The active chat check will be more robustly handled in ChatPage/DMView.
-                if (document.hidden || !isActiveChat(sender)) {
-                    incrementUnreadCount(sender).then(newCount => {
-                        setUnreadCounts(prev => ({ ...prev, [sender]: newCount }));
-                        showNotification(sender, dmPayload.content);
-                    });
-                } else {
-                    // If chat is active, clear unread for this user as they are seeing the message
-                    clearUnreadCount(sender).then(() => {
-                        setUnreadCounts(prev => ({ ...prev, [sender]: 0 }));
-                    });
-                }
-            }
+    const handleMessage = (message: WebSocketMessage) => {
+      if (message.type === 'presence') {
+        setOnlineUsers(sortPresence(message.users));
+      } else if (message.type === 'presence_delta') {
+        const { updated, removed } = message;
+        const changed = new Set([...removed, ...updated.map(u => u.username)]);
+        setOnlineUsers((prevUsers) =>
+          sortPresence([...prevUsers.filter(u => !changed.has(u.username)), ...updated])
+        );
+      } else if (message.type === 'chat') { // Global chat message
+        setGlobalChatMessages((prevMessages) => {
+          if (prevMessages.find(m => m.id === message.payload.id)) return prevMessages;
+          const newMessages = [...prevMessages, message.payload];
+          newMessages.sort((a, b) => new Date(a.timestamp).getTime() - new Date(b.timestamp).getTime());
+          return newMessages;
+        });
+      } else if (message.type === 'dm' || message.type === 'dm_receipt') {
+        const dmPayload = message.payload;
+        // Determine the other user involved in the DM
+        // For 'dm', `from_user` is the sender. For 'dm_receipt', `target` is the other user.
+        const otherUser = message.type === 'dm' ? (message.payload as DirectMessage['payload']).from_user : dmPayload.target;
+
+        if (!otherUser) {
+          console.error("DM or receipt does not have a valid other user:", message);
+          return;
+        }
+
+        setDirectMessages(prevDms => {
+          const userDms = prevDms[otherUser] || [];
+          if (userDms.find(m => m.id === dmPayload.id)) return prevDms; // Avoid duplicates
+          const updatedUserDms = [...userDms, dmPayload];
+          updatedUserDms.sort((a, b) => new Date(a.timestamp).getTime() - new Date(b.timestamp).getTime());
+          return { ...prevDms, [otherUser]: updatedUserDms };
+        });
+
+        // Handle unread counts and notifications for incoming DMs ('dm' type)
+        // Only increment if the message is from another user (not a receipt for self-sent message)
+        // and the chat window for this user is not currently active (this check happens in ChatPage.tsx)
+        if (message.type === 'dm') {
+          const sender = (message.payload as DirectMessage['payload']).from_user;
+          // Check if the current user is the recipient
+          if (dmPayload.target === currentUsernameRef.current) {
+               // Heuristic: if document is hidden or chat with `sender` is not active, increment unread.
+               // The active chat check will be more robustly handled in ChatPage/DMView.
+              if (document.hidden || !isActiveChat(sender)) {
+                  incrementUnreadCount(sender).then(newCount => {
+                      setUnreadCounts(prev => ({ ...prev, [sender]: newCount }));
+                      showNotification(sender, dmPayload.content);
+                  });
+              } else {
+                  // If chat is active, clear unread for this user as they are seeing the message
+                  clearUnreadCount(sender).then(() => {
+                      setUnreadCounts(prev => ({ ...prev, [sender]: 0 }));
+                  });
+              }
           }
-        } else if (message.type === 'error') {
-          // Handle errors, e.g., display a toast notification to the user
-          console.error('Received error from server:', message.payload.message);
-          // Example: alert(message.payload.message);
         }
+      } else if (message.type === 'error') {
+        // Handle errors, e.g., display a toast notification to the user
+        console.error('Received error from server:', message.payload.message);
+        // Example: alert(message.payload.message);
+      }
+    };
 
+    socketRef.current.onmessage = (event) => {
+      try {
+        const data = frameDecoder.decode(event.data as ArrayBuffer);
+        const parsed = JSON.parse(data) as WebSocketMessage | BatchMessage; // Use the union type
+        (parsed.type === 'batch' ? parsed.frames : [parsed]).forEach(handleMessage);
       } catch (error) {
         console.error('Error processing message from WebSocket:', error);
       }
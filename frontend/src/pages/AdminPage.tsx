@@ -7,6 +7,9 @@ import {
 
 type AdminSection = "users" | "removals";
 
+// Every server frame is JSON sent as a binary (UTF-8) frame
+const frameDecoder = new TextDecoder();
+
 // Define the shape of the WebSocket message payload for admin events
 interface AdminEventPayload {
   event_type: string;
@@ -69,6 +72,7 @@ const AdminPage: React.FC = () => {
 
         console.log("Attempting to connect WebSocket to:", wsUrl);
         ws.current = new WebSocket(wsUrl);
+        ws.current.binaryType = 'arraybuffer'; // JSON arrives as binary (UTF-8) frames
 
         ws.current.onopen = () => {
             console.log("WebSocket connected to AdminPage");
@@ -76,22 +80,27 @@ const AdminPage: React.FC = () => {
 
         ws.current.onmessage = (event) => {
             try {
-                const message = JSON.parse(event.data as string);
-                console.log("WebSocket message received:", message);
-
-                if (message.type === "admin_event" && message.payload) {
-                    const payload = message.payload as AdminEventPayload;
-                    if (payload.event_type === "removal_request_updated") {
-                        console.log("Removal request updated event received, refreshing list:", payload);
-                        // Option 1: Simple refresh
-                        loadRemovalRequests();
-
-                        // Option 2: More granular update (if payload contains full updated item)
-                        // setRemovalRequests(prevRequests =>
-                        //   prevRequests.map(req =>
-                        //     req.id === payload.request_id ? { ...req, status: payload.status, ...payload.updated_data } : req
-                        //   )
-                        // );
+                const data = frameDecoder.decode(event.data as ArrayBuffer);
+                const parsed = JSON.parse(data);
+                // Several messages queued at once arrive as one batch frame
+                const messages = parsed.type === "batch" ? parsed.frames : [parsed];
+                for (const message of messages) {
+                    console.log("WebSocket message received:", message);
+
+                    if (message.type === "admin_event" && message.payload) {
+                        const payload = message.payload as AdminEventPayload;
+                        if (payload.event_type === "removal_request_updated") {
+                            console.log("Removal request updated event received, refreshing list:", payload);
+                            // Option 1: Simple refresh
+                            loadRemovalRequests();
+
+                            // Option 2: More granular update (if payload contains full updated item)
+                            // setRemovalRequests(prevRequests =>
+                            //   prevRequests.map(req =>
+                            //     req.id === payload.request_id ? { ...req, status: payload.status, ...payload.updated_data } : req
+                            //   )
+                            // );
+                        }
                     }
                 }
             } catch (e) {